@@ -2,9 +2,10 @@
 import numpy as np
 import cv2
 from matplotlib import pyplot as plt
-from typing import Tuple, List
+from typing import Tuple, List, NamedTuple, Dict, Set, FrozenSet
 import random
-import itertools
+
+from instrument import NULL as NULL_INSTRUMENT
 
 
 Slice = List[Tuple[int, int]]
@@ -28,6 +29,28 @@ def calc_connectivity(slice: np.ndarray) -> Tuple[int, Slice]:
         (4,7) --> 4 is the point where connectivity is started
               --> 7 is the point where it finished
     """
+    free = np.asarray(slice) == 1
+    # Every change between free space and obstacle is a run edge. The pixel
+    # before the slice counts as obstacle, so edges alternate start, end, ...
+    edges = np.flatnonzero(np.diff(free, prepend=False))
+    starts = edges[0::2]
+    ends = edges[1::2]
+    # A run touching the end of the slice is never closed, same as the loop below
+    connectivity = len(ends)
+    connective_parts = list(zip(starts[:connectivity].tolist(), ends.tolist()))
+    return connectivity, connective_parts
+
+
+def calc_connectivity_loop(slice: np.ndarray) -> Tuple[int, Slice]:
+    """
+    Pure Python version of calc_connectivity, kept as reference for the benchmarks.
+
+    Args:
+        slice: rows. A slice of map.
+
+    Returns:
+        The connectivity number and connectivity parts.
+    """
     connectivity = 0
     last_data = 0
     open_part = False
@@ -65,139 +88,695 @@ def get_adjacency_matrix(parts_left: Slice, parts_right: Slice) -> np.ndarray:
 
     return adjacency_matrix
 
-def remove_duplicates(in_list):
+class RunTable(NamedTuple):
     """
-        This function removes duplicates in the input list, where
-        input list is composed of unhashable elements
-        Example:
-            in_list = [[1,2],[1,2],[2,3]]
-            output = remove_duplicates(in_list)
-            output --> [[1,2].[2,3]]
+    Free space runs of all columns of a map in CSR layout.
+
+    Runs of column col are starts[offsets[col]:offsets[col + 1]] and
+    ends[offsets[col]:offsets[col + 1]], from top to bottom. Same (start, end)
+    convention as calc_connectivity.
     """
-    out_list = []
-    in_list.sort()
-    out_list = list(in_list for in_list,_ in itertools.groupby(in_list))
-    #print("input_list: ", in_list)
-    #print("output list: ",out_list)
-    return out_list
+    offsets: np.ndarray
+    starts: np.ndarray
+    ends: np.ndarray
+
+    @property
+    def counts(self) -> np.ndarray:
+        """Connectivity of every column."""
+        return np.diff(self.offsets)
+
+    def column(self, col: int) -> Tuple[int, Slice]:
+        """Same output as calc_connectivity(img[:, col])."""
+        begin, end = self.offsets[col], self.offsets[col + 1]
+        parts = list(zip(self.starts[begin:end].tolist(), self.ends[begin:end].tolist()))
+        return len(parts), parts
 
-def bcd(erode_img: np.ndarray) -> Tuple[np.ndarray, int]:
+
+# Pixels per column block, bounds the temporary memory of the sweep
+BLOCK_PIXELS = 1 << 24
+
+
+def column_blocks(shape: Tuple[int, int], block_cols: int = None):
     """
-    Boustrophedon Cellular Decomposition
+    Splits the columns of a map into [begin, end) blocks of block_cols columns.
+    By default a block has about BLOCK_PIXELS pixels.
+    """
+    height, width = shape
+    if block_cols is None:
+        block_cols = max(1, BLOCK_PIXELS // max(height, 1))
+    for begin in range(0, width, block_cols):
+        yield begin, min(begin + block_cols, width)
+
+
+class PackedMap:
+    """
+    Bit-packed binary map, 1 bit per pixel (free space is 1).
+
+    Columns are packed one after the other, bits[col] is column col with 8 rows
+    per byte (np.packbits order), so a column is contiguous in memory.
+    It can be given to column_runs and bcd_sweep in place of erode_img.
+    """
+    def __init__(self, bits: np.ndarray, height: int):
+        self.bits = bits
+        self.height = height
+
+    @classmethod
+    def from_map(cls, erode_img: np.ndarray, block_cols: int = None) -> 'PackedMap':
+        """Packs an eroded map block by block, so erode_img can be memory-mapped."""
+        assert len(erode_img.shape) == 2, 'Map should be single channel.'
+        height, width = erode_img.shape
+        bits = np.zeros([width, (height + 7) // 8], dtype=np.uint8)
+        for begin, end in column_blocks(erode_img.shape, block_cols):
+            bits[begin:end] = np.packbits(np.asarray(erode_img[:, begin:end]).T == 1, axis=1)
+        return cls(bits, height)
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.height, len(self.bits)
+
+    def __getitem__(self, index) -> np.ndarray:
+        """Unpacks map[rows, cols] as uint8, e.g. packed[:, begin:end]."""
+        rows, cols = index
+        return np.unpackbits(self.bits[cols], axis=-1, count=self.height).T[rows]
+
+
+def _run_table(width: int, counts: List[np.ndarray], all_starts: List[np.ndarray],
+               all_ends: List[np.ndarray]) -> RunTable:
+    offsets = np.zeros(width + 1, dtype=np.int64)
+    if width:
+        np.cumsum(np.concatenate(counts), out=offsets[1:])
+        return RunTable(offsets, np.concatenate(all_starts), np.concatenate(all_ends))
+    return RunTable(offsets, np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32))
+
+
+def packed_column_runs(packed: PackedMap, block_cols: int = None) -> RunTable:
+    """
+    column_runs of a PackedMap, computed on the packed bytes.
+
+    Transitions are found with one XOR per byte. Most bytes are all free or all
+    obstacle without a transition, only the bytes with transitions are unpacked.
+    """
+    height, width = packed.shape
+    counts, all_starts, all_ends = [], [], []
+    for begin, end in column_blocks(packed.shape, block_cols):
+        # Extra obstacle byte at the bottom, so every column has start/end pairs
+        block = np.zeros([end - begin, packed.bits.shape[1] + 1], dtype=np.uint8)
+        block[:, :-1] = packed.bits[begin:end]
+        # Pixel above every pixel, the top padding is obstacle
+        above = block >> 1
+        above[:, 1:] |= block[:, :-1] << 7
+        transitions = block ^ above
+        cols, byte_index = np.nonzero(transitions)
+        bit_index, bit = np.nonzero(np.unpackbits(transitions[cols, byte_index][:, None], axis=1))
+        rows, cols = byte_index[bit_index] * 8 + bit, cols[bit_index]
+        starts, ends, run_cols = rows[0::2], rows[1::2], cols[0::2]
+        # Runs closed by the bottom padding are dropped, calc_connectivity never closes them
+        closed = ends < height
+        counts.append(np.bincount(run_cols[closed], minlength=end - begin))
+        all_starts.append(starts[closed].astype(np.int32))
+        all_ends.append(ends[closed].astype(np.int32))
+    return _run_table(width, counts, all_starts, all_ends)
+
+
+def _block_transitions(block: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Column and row of every obstacle/free space change of block, column by column.
+
+    The pixels are read in their memory order, row by row for a C-ordered map and
+    column by column for a transposed view. Only the transitions are reordered.
+    """
+    free = np.asarray(block) == 1
+    height, width = free.shape
+    if free.flags.f_contiguous and not free.flags.c_contiguous:
+        # Columns are contiguous, transitions come out column by column
+        padded = np.zeros([width, height + 2], dtype=bool)
+        padded[:, 1:-1] = free.T
+        edges = padded[:, 1:] != padded[:, :-1]
+        return np.divmod(np.flatnonzero(edges), height + 1)
+    # Obstacle padding on both sides, so every column has start/end pairs
+    padded = np.zeros([height + 2, width], dtype=bool)
+    padded[1:-1] = free
+    edges = padded[1:] != padded[:-1]
+    rows, cols = np.divmod(np.flatnonzero(edges), width)
+    return np.divmod(np.sort(cols * (height + 1) + rows), height + 1)
+
+
+def column_runs(erode_img: np.ndarray, block_cols: int = None) -> RunTable:
+    """
+    Extracts the runs of every column, one block of columns at a time.
+
+    Only one block of the map is read at once, so erode_img can be a
+    memory-mapped array (see map_io.py) much larger than the memory.
+    Blocks are read in their memory order, see _block_transitions.
 
     Args:
         erode_img: [H, W], eroded map. The pixel value 0 represents obstacles and 1 for free space.
+            A PackedMap is handled by packed_column_runs.
+        block_cols: columns per block, see column_blocks
 
     Returns:
-        [H, W], separated map. The pixel value 0 represents obstacles and others for its' cell number.
-        current_cell and seperate_img is for display purposes --> which is used to show
-        decomposed cells into a separate figure
-        all_cell_numbers --> contains all cell index numbers
-        cell_boundaries --> contains all cell boundary coordinates (only y coordinate)
-        non_neighboor_cells --> contains cell index numbers of non_neighboor_cells, i.e.
-        cells which are separated by the objects
+        RunTable of the map.
     """
-    
+    if isinstance(erode_img, PackedMap):
+        return packed_column_runs(erode_img, block_cols)
     assert len(erode_img.shape) == 2, 'Map should be single channel.'
+    height, width = erode_img.shape
+    counts, all_starts, all_ends = [], [], []
+    for begin, end in column_blocks(erode_img.shape, block_cols):
+        cols, rows = _block_transitions(erode_img[:, begin:end])
+        starts, ends, run_cols = rows[0::2], rows[1::2], cols[0::2]
+        # Runs closed by the bottom padding are dropped, calc_connectivity never closes them
+        closed = ends < height
+        counts.append(np.bincount(run_cols[closed], minlength=end - begin))
+        all_starts.append(starts[closed].astype(np.int32))
+        all_ends.append(ends[closed].astype(np.int32))
+    return _run_table(width, counts, all_starts, all_ends)
+
+
+def opens_cells(last_connectivity: int, connectivity: int) -> bool:
+    """
+    True if a column starts new cells, False if it keeps the cells of the last column.
+
+    Args:
+        last_connectivity: connectivity of the last column which had free space
+        connectivity: connectivity of the current column
+    """
+    if last_connectivity == 0:
+        return True
+    return connectivity != 0 and connectivity != last_connectivity
+
+
+def assign_cells(runs: RunTable) -> Tuple[np.ndarray, int]:
+    """
+    Assigns a cell number to every run of the run table.
+
+    Args:
+        runs: RunTable of the map.
+
+    Returns:
+        labels --> cell number of every run, 0 for runs which are not part of any cell
+        current_cell --> next free cell number, i.e. total cell number + 1
+    """
+    labels = np.zeros(len(runs.starts), dtype=np.int32)
+    offsets = runs.offsets.tolist()
     last_connectivity = 0
-    last_connectivity_parts = []
     current_cell = 1
     current_cells = []
-    separate_img = np.copy(erode_img)
-    cell_boundaries = {}
-    non_neighboor_cells = []
 
-    for col in range(erode_img.shape[1]):
-        current_slice = erode_img[:, col]
-        connectivity, connective_parts = calc_connectivity(current_slice)
-        
-        if last_connectivity == 0:
-            current_cells = []
-            for i in range(connectivity):
-                current_cells.append(current_cell)
-                current_cell += 1
-        elif connectivity == 0:
+    for col, connectivity in enumerate(runs.counts.tolist()):
+        if connectivity == 0 and last_connectivity != 0:
+            # Column fully blocked, last_connectivity is not updated
             current_cells = []
             continue
+        if opens_cells(last_connectivity, connectivity):
+            # Create new cells for each connected part
+            current_cells = list(range(current_cell, current_cell + connectivity))
+            current_cell += connectivity
         elif connectivity == 1:
-            if last_connectivity == 1:
-                current_cells = [current_cells[0]]
-            else:
-                current_cells = [current_cell]
-                current_cell += 1
-        elif connectivity == 2:
-            if last_connectivity == 1:
-                current_cells = [current_cell, current_cell + 1]
-                current_cell += 2
-            elif last_connectivity == 2:
-                current_cells = current_cells
-            
-            else:
-                current_cells = [current_cell, current_cell + 1]
-                current_cell += 2
-        else:  # connectivity > 2
-            if last_connectivity == connectivity:
-                # If connectivity remains the same, keep the same cells
-                current_cells = current_cells
-            # elif last_connectivity == 3:
-            #     # Keep the first two cells from the last iteration
-            #     # and add a new cell for the additional connectivity
-            #     current_cells = current_cells[:2] + [current_cell]
-            #     current_cell += 1
-            else:
-            # For other cases, create new cells for each connected part
-                current_cells = []
-                for i in range(connectivity):
-                    current_cells.append(current_cell)
-                    current_cell += 1
-        # Draw the partition information on the map.
-        for cell, slice in zip(current_cells, connective_parts):
-            #print("Debug")
-            #print(current_cells, connective_parts)
-            separate_img[slice[0]:slice[1], col] = cell
-        
-            # print('Slice {}: connectivity from {} to {}'.format(col, last_connectivity, connectivity))
+            current_cells = [current_cells[0]]
+        # Otherwise connectivity remains the same, keep the same cells
+
+        if current_cells:
+            labels[offsets[col]:offsets[col] + len(current_cells)] = current_cells
         last_connectivity = connectivity
-        last_connectivity_parts = connective_parts
 
-        #print("Debug")
-        #print(current_cells,connective_parts)
-        
-        #print("Current cell: ", current_cell)
-        if len(current_cells) == 1: #no object in this cell
-            ## cell_index = current_cell -1  # cell index starts from 1
-            ## cell_boundaries.setdefault(cell_index,[])
-            ## cell_boundaries[cell_index].append(connective_parts)
-            cell_index = current_cells[0]
-            cell_boundaries.setdefault(cell_index, [])
-            cell_boundaries[cell_index].append((connective_parts[0][0], connective_parts[-1][1]))
-        elif len(current_cells) > 1: ##cells separated by the object
-            # cells separated by the objects are not neighbor to each other
-            non_neighboor_cells.append(current_cells)
-            # non_neighboor_cells will contain many duplicate values, but we 
-            # will get rid of duplicates at the end
-
-            # in this logic, all other cells must be neighboor to each other
-            # if their cell number are adjacent to each other
-            # like cell1 is neighboor to cell2
-
-            for i in range(len(current_cells)):
-                # current cells list doesn't need cell -1 operation 
-                # it is already in the proper form
-                cell_index = current_cells[i]
-                # connective_parts and current_cells contain more than one
-                # cell info which are separated by the object ,so we are iterating
-                # with the for loop to reach all the cells
-                cell_boundaries.setdefault(cell_index,[])
-                ##cell_boundaries[cell_index].append(connective_parts[i])
-                cell_boundaries[cell_index].append((connective_parts[i][0], connective_parts[i][1]))
-     
+    return labels, current_cell
+
+
+class CellGraph:
+    """
+    Sparse cell adjacency graph in CSR layout.
+
+    Neighbours of a cell are indices[indptr[cell]:indptr[cell + 1]], in ascending
+    order. Cell numbers are used as rows directly, so row 0 is always empty.
+    graph[cell] gives the neighbours as a list, so the graph can be used
+    wherever an adjacency list dict was used before (e.g. dfs.dfs).
+
+    Examples:
+        >>> graph = CellGraph.from_edges(np.array([[1, 2], [2, 3]]), 4)
+        >>> graph[2]
+        [1, 3]
+    """
+    __slots__ = ('indptr', 'indices')
+
+    def __init__(self, indptr: np.ndarray, indices: np.ndarray):
+        self.indptr = indptr
+        self.indices = indices
+
+    @classmethod
+    def from_edges(cls, edges: np.ndarray, total_cells: int) -> 'CellGraph':
+        """
+        Args:
+            edges: [E, 2], undirected edges, every edge only once.
+            total_cells: cell numbers go from 1 to total_cells - 1, like current_cell of bcd.
+        """
+        edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+        src = np.concatenate([edges[:, 0], edges[:, 1]])
+        dst = np.concatenate([edges[:, 1], edges[:, 0]])
+        order = np.lexsort((dst, src))
+        indptr = np.zeros(total_cells + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=total_cells), out=indptr[1:])
+        return cls(indptr, dst[order].astype(np.int32))
+
+    def neighbours(self, cell: int) -> np.ndarray:
+        return self.indices[self.indptr[cell]:self.indptr[cell + 1]]
+
+    def degree(self, cell: int) -> int:
+        return int(self.indptr[cell + 1] - self.indptr[cell])
+
+    @property
+    def edge_count(self) -> int:
+        return len(self.indices) // 2
+
+    def __getitem__(self, cell: int) -> List[int]:
+        if cell not in self:
+            raise KeyError(cell)
+        return self.neighbours(cell).tolist()
+
+    def __contains__(self, cell) -> bool:
+        return 1 <= cell < len(self.indptr) - 1
+
+    def __iter__(self):
+        return iter(range(1, len(self.indptr) - 1))
+
+    def __len__(self) -> int:
+        return max(len(self.indptr) - 2, 0)
+
+    def to_dict(self) -> Dict[int, List[int]]:
+        return {cell: self[cell] for cell in self}
+
+
+def sweep_edges(runs: RunTable, labels: np.ndarray) -> np.ndarray:
+    """
+    Finds the neighbour cells from the run table.
+
+    Two cells are neighbours if one of their runs overlaps a run of the other one
+    in the next column, same overlap test as get_adjacency_matrix. All columns
+    are handled at once, so there is no pairwise cell comparison.
+
+    Args:
+        runs: RunTable of the map.
+        labels: cell number of every run, see assign_cells.
+
+    Returns:
+        [E, 2], every pair of neighbour cells once.
+    """
+    if len(runs.starts) == 0:
+        return np.zeros([0, 2], dtype=np.int32)
+
+    # Put all columns on one axis, so runs stay sorted across the whole table
+    stride = int(runs.ends.max()) + 1
+    run_cols = np.repeat(np.arange(len(runs.offsets) - 1, dtype=np.int64), runs.counts)
+    start_keys = run_cols * stride + runs.starts
+    end_keys = run_cols * stride + runs.ends
+    # Runs of the next column which overlap a run are the block [first, last)
+    next_col = (run_cols + 1) * stride
+    first = np.searchsorted(end_keys, next_col + runs.starts, side='right')
+    last = np.searchsorted(start_keys, next_col + runs.ends, side='left')
+    pair_counts = np.maximum(last - first, 0)
+    left = np.repeat(np.arange(len(first)), pair_counts)
+    right = np.arange(pair_counts.sum()) - np.repeat(np.cumsum(pair_counts) - pair_counts - first, pair_counts)
+
+    left_cells, right_cells = labels[left], labels[right]
+    touching = (left_cells > 0) & (right_cells > 0) & (left_cells != right_cells)
+    edges = np.stack([left_cells[touching], right_cells[touching]], axis=1)
+    return np.unique(np.sort(edges, axis=1), axis=0)
+
+
+def sweep_adjacency(runs: RunTable, labels: np.ndarray) -> Dict[int, Set[int]]:
+    """
+    Builds the cell adjacency graph from the run table, see sweep_edges.
+
+    Returns:
+        {cell: set of neighbour cells} for every cell in labels.
+    """
+    adjacency = {cell: set() for cell in np.unique(labels[labels > 0]).tolist()}
+    for cell, neighbour in sweep_edges(runs, labels).tolist():
+        adjacency[cell].add(neighbour)
+        adjacency[neighbour].add(cell)
+    return adjacency
+
+
+def cell_graph(runs: RunTable, labels: np.ndarray, total_cells: int) -> CellGraph:
+    """
+    Same graph as sweep_adjacency, but as a CellGraph. Memory is O(cells + edges).
+    """
+    return CellGraph.from_edges(sweep_edges(runs, labels), total_cells)
+
+
+def _column_cumsum(values: np.ndarray):
+    """Cumulative sum of every column, in place."""
+    if values.shape[1] < 64:
+        np.cumsum(values, axis=0, out=values)
+        return
+    # Row by row, every step adds two contiguous rows
+    for row in range(1, len(values)):
+        np.add(values[row - 1], values[row], out=values[row])
+
+
+def separate_dtype(map_dtype, current_cell: int) -> np.dtype:
+    """
+    dtype of separate_img for a map of map_dtype, large enough for every cell number.
+
+    A uint8 map can only hold 255 cells, more cells promote it to uint16 and so on.
+    """
+    return np.promote_types(map_dtype, np.min_scalar_type(current_cell))
+
+
+def paint_cells(runs: RunTable, labels: np.ndarray, separate_img: np.ndarray, col_start: int = 0, col_end: int = None):
+    """
+    Draws the cell number of every labeled run of columns [col_start, col_end) on separate_img.
+
+    separate_img holds only these columns, i.e. its column 0 is col_start.
+    Every block of columns is painted in a row-major buffer, then copied to
+    separate_img at once, so there are no per run writes down the columns.
+    """
+    col_end = len(runs.offsets) - 1 if col_end is None else col_end
+    height = separate_img.shape[0]
+    first, last = runs.offsets[col_start], runs.offsets[col_end]
+    if last > first and np.issubdtype(separate_img.dtype, np.integer):
+        # Same error as assigning the first too large cell number
+        too_large = np.flatnonzero(labels[first:last] > np.iinfo(separate_img.dtype).max)
+        if len(too_large):
+            raise OverflowError('Python integer {} out of bounds for {}'.format(
+                labels[first + too_large[0]], separate_img.dtype))
+
+    for begin, end in column_blocks((height, col_end - col_start)):
+        first, last = runs.offsets[col_start + begin], runs.offsets[col_start + end]
+        cells = labels[first:last]
+        labeled = cells > 0
+        cells = cells[labeled]
+        run_cols = np.repeat(np.arange(end - begin), runs.counts[col_start + begin:col_start + end])[labeled]
+        # +cell where a run starts and -cell where it ends, cumsum fills the runs.
+        # Runs never touch, the end of a run is always an obstacle pixel
+        painted = np.zeros([height, end - begin], dtype=np.int32)
+        painted[runs.starts[first:last][labeled], run_cols] = cells
+        painted[runs.ends[first:last][labeled], run_cols] -= cells
+        _column_cumsum(painted)
+        np.copyto(separate_img[:, begin:end], painted, casting='unsafe', where=painted > 0)
+
+
+def non_neighbour_groups(runs: RunTable, labels: np.ndarray) -> List[List[int]]:
+    """
+    Cells which share a column, i.e. cells which are separated by the objects.
+
+    A group is only read where it changes, not for every column. The labels
+    of a column are compared with the labels of the previous column, the
+    whole slice at once. The cell numbers of a column do not have to be
+    consecutive (e.g. after multi_robot.split_cells), only the order of the
+    labeled runs in a column matters.
+
+    Returns:
+        Sorted list of groups without duplicates, same as bcd's non_neighboor_cells.
+    """
+    run_cols = np.repeat(np.arange(len(runs.offsets) - 1), runs.counts)
+    labeled_counts = np.bincount(run_cols[labels > 0], minlength=len(runs.offsets) - 1)
+    cols = np.flatnonzero(labeled_counts > 1)
+    # Labeled runs always come first in a column
+    firsts, counts = runs.offsets[cols], labeled_counts[cols]
+    changed = np.ones(len(cols), dtype=bool)
+    # Columns with as many cells as the previous one changed if any label differs
+    same = np.flatnonzero(counts[1:] == counts[:-1]) + 1
+    same_counts = counts[same]
+    position = np.arange(same_counts.sum()) - np.repeat(np.cumsum(same_counts) - same_counts, same_counts)
+    differs = labels[np.repeat(firsts[same], same_counts) + position] \
+        != labels[np.repeat(firsts[same - 1], same_counts) + position]
+    changed[same] = np.bincount(np.repeat(np.arange(len(same)), same_counts)[differs], minlength=len(same)) > 0
+    groups = {tuple(labels[first:first + count].tolist())
+              for first, count in zip(firsts[changed].tolist(), counts[changed].tolist())}
+    return [list(group) for group in sorted(groups)]
+
+
+class CellDecomposition:
+    """
+    Result of the decomposition, backed by NumPy arrays.
+
+    The boundaries of all cells are stored in one [N, 2] int32 array y_bounds,
+    cell by cell, one (y_start, y_end) per column. Boundaries of a cell are
+    y_bounds[cell_offsets[cell]:cell_offsets[cell + 1]] and its columns are
+    x_start[cell] .. x_end[cell] - 1. Arrays are indexed by cell number.
+
+    It can be used in place of the cell_boundaries dict of bcd:
+    decomposition[cell] gives the [n, 2] boundaries of the cell, and iterating
+    gives the cell numbers in the same order as all_cell_numbers.
+
+    separate_img is always in the orientation of the map. Runs and cell
+    boundaries are in the sweep orientation, for a 'horizontal' sweep columns
+    are the rows of the map and y the x of the map (see sweep_view).
+
+    If separate_img is None, it is painted from the run table and erode_img
+    the first time it is used, see bcd_sweep's lazy. Without either of them
+    the decomposition has only the cells, see lazy_copy, and map_shape has
+    to be given.
+    """
+    __slots__ = ('_separate_img', '_erode_img', '_graph', '_map_shape', '_non_neighbour_set', 'current_cell', 'cells', 'x_start',
+                 'x_end', 'cell_offsets', 'y_bounds', 'non_neighboor_cells', 'runs', 'labels', 'direction')
+
+    def __init__(self, separate_img, current_cell, cells, x_start, x_end, cell_offsets, y_bounds,
+                 non_neighboor_cells, runs, labels, direction='vertical', erode_img=None, graph=None,
+                 map_shape=None):
+        self._separate_img = separate_img
+        self._erode_img = erode_img
+        self._graph = graph
+        self._non_neighbour_set = None
+        if map_shape is None:
+            assert separate_img is not None or erode_img is not None, 'Map size is needed without a map.'
+            map_shape = (separate_img if separate_img is not None else erode_img).shape
+        self._map_shape = tuple(int(size) for size in map_shape)
+        self.current_cell = current_cell
+        self.cells = cells
+        self.x_start = x_start
+        self.x_end = x_end
+        self.cell_offsets = cell_offsets
+        self.y_bounds = y_bounds
+        self.non_neighboor_cells = non_neighboor_cells
+        self.runs = runs
+        self.labels = labels
+        self.direction = direction
+
+    @classmethod
+    def from_runs(cls, runs: RunTable, labels: np.ndarray, current_cell: int, separate_img: np.ndarray,
+                  direction: str = 'vertical', erode_img: np.ndarray = None,
+                  map_shape: Tuple[int, int] = None) -> 'CellDecomposition':
+        """
+        Builds the cell arrays from the run table and run labels (see assign_cells).
+        map_shape is only needed if there is neither separate_img nor erode_img.
+        """
+        labeled = np.flatnonzero(labels)
+        run_cells = labels[labeled]
+        # Stable sort keeps the columns of each cell in order
+        cell_runs = labeled[np.argsort(run_cells, kind='stable')]
+        y_bounds = np.stack([runs.starts[cell_runs], runs.ends[cell_runs]], axis=1).astype(np.int32)
+        cell_offsets = np.zeros(current_cell + 1, dtype=np.int64)
+        np.cumsum(np.bincount(run_cells, minlength=current_cell), out=cell_offsets[1:])
+
+        run_cols = np.repeat(np.arange(len(runs.offsets) - 1, dtype=np.int32), runs.counts)[cell_runs]
+        present = cell_offsets[1:] > cell_offsets[:-1]
+        x_start = np.zeros(current_cell, dtype=np.int32)
+        x_end = np.zeros(current_cell, dtype=np.int32)
+        x_start[present] = run_cols[cell_offsets[:-1][present]]
+        x_end[present] = run_cols[cell_offsets[1:][present] - 1] + 1
+
+        # Cells in order of their first run, like the keys of cell_boundaries
+        cells, first_runs = np.unique(run_cells, return_index=True)
+        cells = cells[np.argsort(first_runs)].astype(np.int32)
+        return cls(separate_img, current_cell, cells, x_start, x_end, cell_offsets, y_bounds,
+                   non_neighbour_groups(runs, labels), runs, labels, direction, erode_img, map_shape=map_shape)
+
+    @property
+    def separate_img(self) -> np.ndarray:
+        """
+        [H, W], separated map. A lazy one is painted now, with a dtype which fits all cell numbers.
+        """
+        if self._separate_img is None:
+            assert self._erode_img is not None, 'No map to paint separate_img from, see lazy_copy.'
+            separate_img = np.asarray(self._erode_img[:, :])
+            separate_img = np.array(separate_img, dtype=separate_dtype(separate_img.dtype, self.current_cell))
+            paint_cells(self.runs, self.labels, sweep_view(separate_img, self.direction))
+            self._separate_img, self._erode_img = separate_img, None
+        return self._separate_img
+
+    @separate_img.setter
+    def separate_img(self, separate_img: np.ndarray):
+        self._separate_img, self._erode_img = separate_img, None
+
+    @property
+    def is_lazy(self) -> bool:
+        """True while separate_img is not painted yet."""
+        return self._separate_img is None
+
+    @property
+    def map_shape(self) -> Tuple[int, int]:
+        """[H, W] of the map, without painting a lazy separate_img. Also known without a map."""
+        return self._map_shape
+
+    def __getitem__(self, cell: int) -> np.ndarray:
+        if cell not in self:
+            raise KeyError(cell)
+        return self.y_bounds[self.cell_offsets[cell]:self.cell_offsets[cell + 1]]
+
+    def __contains__(self, cell) -> bool:
+        return 0 < cell < self.current_cell and self.cell_offsets[cell + 1] > self.cell_offsets[cell]
+
+    def __iter__(self):
+        return iter(self.cells.tolist())
+
+    def __len__(self) -> int:
+        return len(self.cells)
+
+    def keys(self) -> List[int]:
+        return self.cells.tolist()
+
+    def items(self):
+        return ((cell, self[cell]) for cell in self)
+
+    @property
+    def non_neighbour_set(self) -> FrozenSet[Tuple[int, ...]]:
+        """non_neighboor_cells as a set of tuples, for O(1) membership checks. Built on the first use."""
+        if self._non_neighbour_set is None:
+            self._non_neighbour_set = frozenset(tuple(group) for group in self.non_neighboor_cells)
+        return self._non_neighbour_set
+
+    def x_range(self, cell: int) -> range:
+        """Columns of the cell."""
+        return range(self.x_start[cell], self.x_end[cell])
+
+    def graph(self) -> CellGraph:
+        """Cell adjacency graph, see sweep_edges. Built on the first call."""
+        if self._graph is None:
+            self._graph = cell_graph(self.runs, self.labels, self.current_cell)
+        return self._graph
+
+    def lazy_copy(self, erode_img: np.ndarray = None) -> 'CellDecomposition':
+        """
+        Same cells and graph without separate_img, which is painted lazily from erode_img.
+
+        The arrays are shared, not copied. erode_img should be the decomposed map
+        or a map with the same content, without it the copy has only the cells.
+        """
+        assert erode_img is None or tuple(erode_img.shape) == self._map_shape, 'Map size does not match.'
+        return CellDecomposition(None, self.current_cell, self.cells, self.x_start, self.x_end, self.cell_offsets,
+                                 self.y_bounds, self.non_neighboor_cells, self.runs, self.labels, self.direction,
+                                 erode_img, self._graph, self._map_shape)
+
+    def to_dict(self) -> Dict[int, Slice]:
+        """cell_boundaries in the dict of lists of tuples form of bcd."""
+        return {cell: [tuple(bounds) for bounds in self[cell].tolist()] for cell in self}
+
+
+DIRECTIONS = ('vertical', 'horizontal')
+
+
+def sweep_view(img: np.ndarray, direction: str = 'vertical') -> np.ndarray:
+    """
+    View of img in which the sweep goes over the columns.
+
+    'vertical' --> the sweep line is vertical and moves from left to right, img itself
+    'horizontal' --> the sweep line is horizontal and moves from top to bottom, img.T
+    Both are views, the sweep reads the columns of the view as contiguous
+    lines either way (see column_runs and paint_cells).
+    """
+    assert direction in DIRECTIONS, 'Unknown sweep direction {}'.format(direction)
+    if direction == 'vertical':
+        return img
+    assert not isinstance(img, PackedMap), 'Pack the transposed map for a horizontal sweep.'
+    return img.T
+
+
+def bcd_sweep(erode_img: np.ndarray, out: np.ndarray = None, block_cols: int = None,
+              direction: str = 'vertical', lazy: bool = False, instrument=NULL_INSTRUMENT) -> CellDecomposition:
+    """
+    Same decomposition as bcd, but returns a CellDecomposition.
+
+    The run table and labels are kept in the result, so the decomposition can
+    be updated later without sweeping the whole map again (see incremental.py).
+
+    Args:
+        erode_img: [H, W], eroded map, can be memory-mapped (see map_io.py) or a PackedMap.
+        out: [H, W], array for the separated map, e.g. map_io.open_label_map.
+            It is written block by block. By default the separated map is a
+            copy of erode_img in memory (uint8 for a PackedMap), with a larger
+            dtype if the cell numbers do not fit, see separate_dtype.
+        block_cols: columns (rows for a horizontal sweep) per block, see column_blocks
+        direction: 'vertical' or 'horizontal', see sweep_view. The direction
+            which gives fewer cells depends on the map.
+        lazy: do not paint the separated map, it is painted on first use of
+            separate_img. For callers which only need the boundaries and the
+            graph. The result keeps a reference to erode_img until then, so
+            do not modify the map in between.
+        instrument: records the stages column_runs, assign_cells, paint_cells and
+            cell_arrays, and counts columns_swept, runs_found and cells_opened
+    """
+    assert len(erode_img.shape) == 2, 'Map should be single channel.'
+    sweep_img = sweep_view(erode_img, direction)
+    with instrument.stage('column_runs'):
+        runs = column_runs(sweep_img, block_cols)
+    instrument.count('columns_swept', len(runs.offsets) - 1)
+    instrument.count('runs_found', len(runs.starts))
+    with instrument.stage('assign_cells'):
+        labels, current_cell = assign_cells(runs)
+    instrument.count('cells_opened', current_cell - 1)
+
+    separate_img = None
+    if not lazy or out is not None:
+        with instrument.stage('paint_cells'):
+            if out is None:
+                separate_img = np.asarray(erode_img[:, :])
+                separate_img = np.array(separate_img, dtype=separate_dtype(separate_img.dtype, current_cell))
+                paint_cells(runs, labels, sweep_view(separate_img, direction))
+            else:
+                assert out.shape == erode_img.shape, 'Output should have the same size as the map.'
+                separate_img = out
+                sweep_out = sweep_view(out, direction)
+                for begin, end in column_blocks(sweep_img.shape, block_cols):
+                    block = np.array(sweep_img[:, begin:end], dtype=out.dtype)
+                    paint_cells(runs, labels, block, begin, end)
+                    sweep_out[:, begin:end] = block
+    with instrument.stage('cell_arrays'):
+        return CellDecomposition.from_runs(runs, labels, current_cell, separate_img, direction,
+                                           erode_img if separate_img is None else None)
+
+
+def bcd(erode_img: np.ndarray, adjacency: bool = False, direction: str = 'vertical',
+        instrument=NULL_INSTRUMENT) -> Tuple[np.ndarray, int]:
+    """
+    Boustrophedon Cellular Decomposition
+
+    The runs of all columns are extracted first (column_runs), then cells are
+    assigned over the run table (assign_cells).
+
+    Args:
+        erode_img: [H, W], eroded map. The pixel value 0 represents obstacles and 1 for free space.
+        direction: sweep direction, see bcd_sweep. For 'horizontal', cell_boundaries
+            are x boundaries per row.
+        instrument: see instrument.py, records the stages of bcd_sweep, cell_boundaries
+            and adjacency, and counts adjacency_edges
+
+    Returns:
+        [H, W], separated map. The pixel value 0 represents obstacles and others for its' cell number.
+        current_cell and seperate_img is for display purposes --> which is used to show
+        decomposed cells into a separate figure
+        all_cell_numbers --> contains all cell index numbers
+        cell_boundaries --> contains all cell boundary coordinates (only y coordinate)
+        non_neighboor_cells --> contains cell index numbers of non_neighboor_cells, i.e.
+        cells which are separated by the objects
+        cell_adjacency --> only if adjacency is True, CellGraph of the cells
+        built from the same run table, see sweep_edges
+    """
+    decomposition = bcd_sweep(erode_img, direction=direction, instrument=instrument)
+    with instrument.stage('cell_boundaries'):
+        cell_boundaries = decomposition.to_dict()
     # Cell 1 is the left most cell and cell n is the right most cell
     # where n is the total cell number
-    all_cell_numbers = cell_boundaries.keys()
-    non_neighboor_cells = remove_duplicates(non_neighboor_cells)
-    
-    return separate_img, current_cell, list(all_cell_numbers), cell_boundaries, non_neighboor_cells
+    all_cell_numbers = list(cell_boundaries.keys())
+    output = (decomposition.separate_img, decomposition.current_cell, all_cell_numbers,
+              cell_boundaries, decomposition.non_neighboor_cells)
+    if adjacency:
+        with instrument.stage('adjacency'):
+            graph = decomposition.graph()
+        instrument.count('adjacency_edges', graph.edge_count)
+        return output + (graph,)
+    return output
 
 def display_separate_map(separate_map, cells):
     display_img = np.empty([*separate_map.shape, 3], dtype=np.uint8)
@@ -276,12 +855,22 @@ def display_separate_map(separate_map, cells):
 #             if min(b1[1], b2[1]) - max(b1[0], b2[0]) > 0:
 #                 return True
 #     return False
-def calculate_neighbour_matrix(cells, boundaries, nonneighbour_cells):
+def calculate_neighbour_matrix(cells, boundaries, nonneighbour_cells, instrument=NULL_INSTRUMENT):
+    with instrument.stage('neighbour_matrix'):
+        adjacency_matrix, comparisons = _neighbour_matrix(cells, boundaries, nonneighbour_cells)
+    instrument.count('adjacency_comparisons', comparisons)
+    return adjacency_matrix
+
+
+def _neighbour_matrix(cells, boundaries, nonneighbour_cells):
+    comparisons = 0
     total_cell_number = len(cells)
     adjacency_matrix = [[0] * total_cell_number for _ in range(total_cell_number)]
 
     # Create a mapping from cell number to its index
     cell_to_index = {cell: idx for idx, cell in enumerate(cells)}
+    # Hashable groups, so the non-neighbour checks below are O(1)
+    nonneighbour_set = {tuple(group) for group in nonneighbour_cells}
 
     for i in range(total_cell_number):
         current_cell = cells[i]
@@ -304,15 +893,16 @@ def calculate_neighbour_matrix(cells, boundaries, nonneighbour_cells):
             other_index = cell_to_index[other_cell]
 
             # Skip if cells are explicitly marked as non-neighbours
-            if [current_cell, other_cell] in nonneighbour_cells or [other_cell, current_cell] in nonneighbour_cells:
+            if (current_cell, other_cell) in nonneighbour_set or (other_cell, current_cell) in nonneighbour_set:
                 continue
 
             # Check if the boundaries of the two cells overlap
+            comparisons += 1
             if are_cells_adjacent(boundaries[current_cell], boundaries[other_cell]):
                 adjacency_matrix[current_index][other_index] = 1
                 adjacency_matrix[other_index][current_index] = 1
 
-    return adjacency_matrix
+    return adjacency_matrix, comparisons
 
 # def are_cells_adjacent(boundary1, boundary2):
 #     for b1 in boundary1:
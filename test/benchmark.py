@@ -0,0 +1,228 @@
+"""
+Headless benchmarks for the decomposition code.
+
+Run from anywhere:
+    python benchmark.py --output benchmark.json
+    python benchmark.py --connectivity-loop
+
+The suite decomposes synthetic maps of controlled size and obstacles
+(synthetic_map) and the maps in ../results, converted to binary the same way
+main.py does it. Every stage is timed on its own (best of repeat runs):
+calc_connectivity over all columns, the decomposition, the adjacency graph,
+the DFS traversal and the path generation. Throughput (pixels/s, cells/s)
+and peak memory (tracemalloc, one extra run) are reported, and everything
+is written to a JSON file to track regressions.
+
+--connectivity-loop prints the old table instead: calc_connectivity timed
+against the pure Python loop on all columns.
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import time
+import timeit
+import tracemalloc
+
+import numpy as np
+
+import bcd
+import dfs
+import map_io
+import move_boustrophedon
+
+
+RESULTS_DIR = map_io.RESULTS_DIR
+
+
+def sweep_columns(connectivity_fn, binary_map):
+    return [connectivity_fn(binary_map[:, col]) for col in range(binary_map.shape[1])]
+
+
+def benchmark_connectivity(binary_map, iter_number=3):
+    """
+    Times calc_connectivity and calc_connectivity_loop over every column of the map.
+
+    Returns:
+        (loop seconds, numpy seconds) per full sweep.
+    """
+    assert sweep_columns(bcd.calc_connectivity, binary_map) == \
+        sweep_columns(bcd.calc_connectivity_loop, binary_map), 'Outputs differ'
+    loop_time = timeit.timeit(lambda: sweep_columns(bcd.calc_connectivity_loop, binary_map),
+                              number=iter_number) / iter_number
+    numpy_time = timeit.timeit(lambda: sweep_columns(bcd.calc_connectivity, binary_map),
+                               number=iter_number) / iter_number
+    return loop_time, numpy_time
+
+
+def result_maps():
+    """Paths of the maps in ../results, without the outputs of main.py."""
+    return map_io.find_maps([RESULTS_DIR])
+
+
+def synthetic_map(height, width, obstacles, shape='rect', obstacle_size=0.1, seed=0):
+    """
+    Occupancy map with randomly placed obstacles, same seed gives the same map.
+
+    The map has a wall around it like the maps in ../results. bcd needs it,
+    runs which reach the bottom row are not counted.
+
+    Args:
+        height, width: map size in pixels
+        obstacles: number of obstacles
+        shape: 'rect', 'circle' or 'mixed'
+        obstacle_size: largest obstacle size as a fraction of the smaller map side
+        seed: seed of the random generator
+
+    Returns:
+        [H, W] uint8 map, 1 for free space and 0 for obstacles.
+    """
+    assert shape in ('rect', 'circle', 'mixed'), 'Unknown obstacle shape {}'.format(shape)
+    rng = np.random.default_rng(seed)
+    binary_map = np.ones([height, width], dtype=np.uint8)
+    max_size = max(2, int(min(height, width) * obstacle_size))
+    for k in range(obstacles):
+        x, y = int(rng.integers(0, width)), int(rng.integers(0, height))
+        size_x, size_y = rng.integers(1, max_size, 2).tolist()
+        if shape == 'rect' or (shape == 'mixed' and k % 2 == 0):
+            bcd.cv2.rectangle(binary_map, (x, y), (x + size_x, y + size_y), 0, -1)
+        else:
+            bcd.cv2.circle(binary_map, (x, y), size_x // 2 + 1, 0, -1)
+    binary_map[[0, -1], :] = 0
+    binary_map[:, [0, -1]] = 0
+    return binary_map
+
+
+def time_stage(fn, repeat=3):
+    """
+    Best time of repeat calls of fn, and the peak traced memory of one more call.
+
+    Returns:
+        (seconds, peak bytes, result of the last call)
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    # Separate run, tracemalloc slows down the allocations
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return min(times), peak, result
+
+
+def benchmark_map(binary_map, repeat=3, robot_size=5):
+    """
+    Times every stage of the planning on one map.
+
+    Returns:
+        {stage: {'seconds', 'peak_bytes', 'pixels_per_s' or 'cells_per_s'}} and the cell number.
+    """
+    pixels = binary_map.size
+    # int32 map, the uint8 separated map overflows above 255 cells
+    erode_img = binary_map.astype(np.int32)
+    stages = {}
+
+    def record(name, fn, per_pixel):
+        seconds, peak, result = time_stage(fn, repeat)
+        stages[name] = {'seconds': seconds, 'peak_bytes': peak}
+        amount = pixels if per_pixel else max(cells, 1)
+        stages[name]['pixels_per_s' if per_pixel else 'cells_per_s'] = amount / seconds if seconds else None
+        return result
+
+    cells = 0
+    record('calc_connectivity', lambda: sweep_columns(bcd.calc_connectivity, binary_map), True)
+    decomposition = record('bcd', lambda: bcd.bcd_sweep(erode_img), True)
+    cells = len(decomposition)
+    graph = record('adjacency', lambda: bcd.cell_graph(decomposition.runs, decomposition.labels,
+                                                       decomposition.current_cell), False)
+    start_cell = decomposition.keys()[0] if cells else 1
+    # A new cleaned list for every run, otherwise every run after the first one returns at once
+    order = record('dfs', lambda: list(dfs.iter_dfs(graph, start_cell)) if cells else [], False)
+
+    def plan():
+        x_coordinates = move_boustrophedon.calculate_x_coordinates(
+            binary_map.shape[1], binary_map.shape[0], decomposition.keys(), decomposition,
+            decomposition.non_neighboor_cells)
+        return move_boustrophedon.plan_paths(x_coordinates, decomposition, order, robot_size)
+    record('paths', plan, False)
+    return stages, cells
+
+
+def run_suite(maps, repeat=3):
+    """
+    Benchmarks every (name, binary_map) of maps.
+
+    Returns:
+        JSON serializable dict with the environment and one entry per map.
+    """
+    results = []
+    for name, binary_map in maps:
+        stages, cells = benchmark_map(binary_map, repeat)
+        results.append({'map': name, 'height': int(binary_map.shape[0]), 'width': int(binary_map.shape[1]),
+                        'free_ratio': float(np.mean(binary_map == 1)), 'cells': cells, 'stages': stages})
+    return {'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+            'numpy': np.__version__, 'platform': platform.platform(), 'repeat': repeat, 'results': results}
+
+
+def suite_maps(sizes, obstacles, shapes, seed=0, with_results=True):
+    """Synthetic maps of every size, obstacle number and shape, then the maps in ../results."""
+    maps = []
+    for height, width in sizes:
+        for count in obstacles:
+            for shape in shapes:
+                name = 'synthetic_{}x{}_{}_{}'.format(height, width, count, shape)
+                maps.append((name, synthetic_map(height, width, count, shape, seed=seed)))
+    if with_results:
+        maps += [(os.path.basename(path), map_io.load_map(path)) for path in result_maps()]
+    return maps
+
+
+def print_connectivity_loop():
+    print("{:<24}{:>12}{:>12}{:>12}{:>10}".format('map', 'size', 'loop [s]', 'numpy [s]', 'speedup'))
+    for path in sorted(glob.glob(os.path.join(RESULTS_DIR, '*.png'))):
+        binary_map = map_io.load_map(path)
+        loop_time, numpy_time = benchmark_connectivity(binary_map)
+        size = '{}x{}'.format(*binary_map.shape)
+        print("{:<24}{:>12}{:>12.4f}{:>12.4f}{:>10.1f}".format(
+            os.path.basename(path), size, loop_time, numpy_time, loop_time / numpy_time))
+
+
+def _size(text):
+    height, width = text.lower().split('x')
+    return int(height), int(width)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Headless benchmarks of the decomposition and planning.')
+    parser.add_argument('--output', default='benchmark.json', help='JSON file for the results')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per stage, the best one is kept')
+    parser.add_argument('--sizes', type=_size, nargs='+', default=[(500, 500), (1000, 2000)],
+                        help='synthetic map sizes as HxW')
+    parser.add_argument('--obstacles', type=int, nargs='+', default=[10, 100], help='obstacles per synthetic map')
+    parser.add_argument('--shapes', nargs='+', default=['rect', 'circle'], help='rect, circle or mixed')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic maps')
+    parser.add_argument('--no-results', action='store_true', help='skip the maps in ../results')
+    parser.add_argument('--connectivity-loop', action='store_true',
+                        help='only compare calc_connectivity with the pure Python loop')
+    args = parser.parse_args()
+
+    if args.connectivity_loop:
+        print_connectivity_loop()
+    else:
+        suite = run_suite(suite_maps(args.sizes, args.obstacles, args.shapes, args.seed, not args.no_results),
+                          args.repeat)
+        print("{:<34}{:>7}{:>10}{:>10}{:>10}{:>10}{:>10}{:>10}".format(
+            'map', 'cells', 'conn [s]', 'bcd [s]', 'adj [s]', 'dfs [s]', 'path [s]', 'bcd MB'))
+        for result in suite['results']:
+            stages = result['stages']
+            print("{:<34}{:>7}{:>10.4f}{:>10.4f}{:>10.4f}{:>10.4f}{:>10.4f}{:>10.1f}".format(
+                result['map'], result['cells'], stages['calc_connectivity']['seconds'], stages['bcd']['seconds'],
+                stages['adjacency']['seconds'], stages['dfs']['seconds'], stages['paths']['seconds'],
+                stages['bcd']['peak_bytes'] / 1e6))
+        with open(args.output, 'w') as f:
+            json.dump(suite, f, indent=2)
+        print('Results written to', args.output)
@@ -0,0 +1,176 @@
+"""
+Content-addressed cache of decompositions.
+
+The key is a hash of the map content and the decomposition parameters, so
+the same floor map gives a hit even if it was loaded again from disk.
+Entries keep the cells and the adjacency graph, but not separate_img nor
+the map: a hit returns a lazy decomposition of the map given to decompose
+(see bcd.CellDecomposition.lazy_copy). On disk every entry is a directory
+in the map_io.save_decomposition format, loaded memory-mapped.
+
+    decomposition_cache = cache.DecompositionCache(max_entries=16, cache_dir='bcd_cache')
+    decomposition = decomposition_cache.decompose(binary_map)
+    graph = decomposition.graph()
+"""
+import abc
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import bcd
+import map_io
+
+
+def map_key(erode_img: np.ndarray, **params) -> str:
+    """
+    Hash of the map content, its shape and dtype and the decomposition parameters.
+
+    The map is hashed one block of rows at a time, so it can be memory-mapped.
+    Rows of a C-ordered map are hashed without a copy.
+    """
+    digest = hashlib.sha256()
+    if isinstance(erode_img, bcd.PackedMap):
+        digest.update(b'packed')
+        erode_img = erode_img.bits
+    digest.update(repr((erode_img.shape, str(erode_img.dtype), sorted(params.items()))).encode())
+    block_rows = max(1, bcd.BLOCK_PIXELS // max(erode_img.shape[1], 1))
+    for begin in range(0, erode_img.shape[0], block_rows):
+        digest.update(np.ascontiguousarray(erode_img[begin:begin + block_rows]).data)
+    return digest.hexdigest()
+
+
+class LRUCache(abc.ABC):
+    """
+    LRU cache in memory, optionally backed by a directory on disk.
+
+    Subclasses must say how an entry is saved to (_save) and loaded from (_load)
+    a path in cache_dir, the file name is the key and suffix.
+
+    hits --> found in memory
+    disk_hits --> not in memory but on disk
+    misses --> computed, counted by the subclass with _miss
+    evictions --> dropped from memory, they stay on disk
+    """
+    suffix = ''
+
+    def __init__(self, max_entries: int = 32, cache_dir: str = None):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key) -> bool:
+        return key in self._entries
+
+    def stats(self) -> dict:
+        return {'hits': self.hits, 'disk_hits': self.disk_hits, 'misses': self.misses,
+                'evictions': self.evictions, 'entries': len(self._entries)}
+
+    def clear(self):
+        """Empties the memory cache, files on disk are kept."""
+        with self._lock:
+            self._entries.clear()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + self.suffix)
+
+    @abc.abstractmethod
+    def _save(self, path, entry):
+        """Writes entry to path, which does not exist yet."""
+
+    @abc.abstractmethod
+    def _load(self, path):
+        """Entry saved to path by _save."""
+
+    def _miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def get(self, key: str):
+        """Cached entry of key, None if it is not cached."""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+        if self.cache_dir is None or not os.path.exists(self._path(key)):
+            return None
+        entry = self._load(self._path(key))
+        with self._lock:
+            self.disk_hits += 1
+        self._insert(key, entry)
+        return entry
+
+    def _insert(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def _store(self, key, entry):
+        """Saves entry to disk if it is not there yet."""
+        if self.cache_dir is None or os.path.exists(self._path(key)):
+            return
+        # Write and rename, so other processes never read half written entries
+        temp_dir = tempfile.mkdtemp(dir=self.cache_dir, suffix='.tmp')
+        temp_path = os.path.join(temp_dir, key + self.suffix)
+        try:
+            self._save(temp_path, entry)
+            os.rename(temp_path, self._path(key))
+        except OSError:
+            # Another process saved the same entry meanwhile
+            pass
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+class DecompositionCache(LRUCache):
+    """
+    LRU cache of decompositions, on disk in the map_io.save_decomposition format.
+
+    Entries have the cells and the graph but no map, see bcd.CellDecomposition.lazy_copy.
+    """
+    def _save(self, path, decomposition):
+        map_io.save_decomposition(path, decomposition)
+
+    def _load(self, path):
+        return map_io.load_decomposition(path)
+
+    def get(self, key: str) -> bcd.CellDecomposition:
+        """Cached entry of key, without a map. None if it is not cached."""
+        return super().get(key)
+
+    def put(self, key: str, decomposition: bcd.CellDecomposition):
+        """Caches the cells and the graph of decomposition, in memory and on disk."""
+        decomposition.graph()
+        self._insert(key, decomposition.lazy_copy())
+        self._store(key, decomposition)
+
+    def decompose(self, erode_img: np.ndarray, direction: str = 'vertical') -> bcd.CellDecomposition:
+        """
+        Same as bcd.bcd_sweep(erode_img, direction=direction, lazy=True), from the cache if possible.
+        """
+        key = map_key(erode_img, direction=direction)
+        entry = self.get(key)
+        if entry is None:
+            self._miss()
+            decomposition = bcd.bcd_sweep(erode_img, direction=direction, lazy=True)
+            self.put(key, decomposition)
+            return decomposition
+        return entry.lazy_copy(erode_img)
@@ -1,7 +1,31 @@
-def dfs(cleaned, graph, node):
-    if node not in cleaned:
-        #print("Path: ", node)
-        cleaned.append(node)
-        for neighbour in graph[node]:
-            dfs(cleaned, graph, neighbour)
+def iter_dfs(graph, node, cleaned=()):
+    """
+        Iterative depth-first search, yields the cells in visiting order
+        Input: graph --> adjacency list, graph[cell] gives the neighbour cells
+        Input: node --> starting cell
+        Input: cleaned --> cells which are already cleaned, they are skipped
+        Output: cells in the same order as the recursive version gave them
+    """
+    visited = set(cleaned)
+    if node in visited:
+        return
+    visited.add(node)
+    yield node
+    # Each stack entry is the remaining neighbours of a cell on the current path
+    stack = [iter(graph[node])]
+    while stack:
+        for neighbour in stack[-1]:
+            if neighbour not in visited:
+                visited.add(neighbour)
+                yield neighbour
+                stack.append(iter(graph[neighbour]))
+                break
+        else:
             #print("Back at: ", node)
+            stack.pop()
+
+
+def dfs(cleaned, graph, node):
+    for cell in iter_dfs(graph, node, cleaned):
+        #print("Path: ", cell)
+        cleaned.append(cell)
@@ -0,0 +1,136 @@
+"""
+Robot footprint preprocessing.
+
+bcd expects a map in which the robot footprint is already taken into
+account: a robot of radius r can only go to pixels which are more than r
+pixels away from every obstacle. The Euclidean distance to the closest
+obstacle is computed once per map (cv2.distanceTransform), after that the
+eroded map of every robot radius is only a threshold:
+
+    footprints = footprint.FootprintCache(cache_dir='footprint_cache')
+    for radius in (3, 5, 8):
+        erode_img = footprints.erode(binary_map, radius)
+        decomposition = bcd.bcd_sweep(erode_img)
+
+distance > radius is the same as an erosion with a disk of that radius,
+pixels outside of the map count as obstacles.
+"""
+import os
+
+import cv2
+import numpy as np
+
+import bcd
+import cache
+
+
+def distance_map(binary_map: np.ndarray) -> np.ndarray:
+    """
+    Euclidean distance of every pixel to the closest obstacle.
+
+    Args:
+        binary_map: [H, W], the pixel value 0 represents obstacles and 1 for free space.
+
+    Returns:
+        [H, W] float32, 0 on obstacles. Outside of the map is obstacle, so
+        the pixels of the border have distance 1.
+    """
+    binary_map = np.asarray(binary_map[:, :])
+    # Obstacle frame around the map, distanceTransform treats the image border as free
+    framed = cv2.copyMakeBorder(np.ascontiguousarray(binary_map != 0, dtype=np.uint8), 1, 1, 1, 1,
+                                cv2.BORDER_CONSTANT, value=0)
+    return cv2.distanceTransform(framed, cv2.DIST_L2, cv2.DIST_MASK_PRECISE)[1:-1, 1:-1]
+
+
+def erode_map(distances: np.ndarray, radius: float) -> np.ndarray:
+    """
+    Free space of a robot with the given radius in pixels, from distance_map.
+
+    Returns:
+        [H, W] uint8, 1 where the robot fits, which can be given to bcd.bcd_sweep.
+        Radius 0 gives the map itself.
+    """
+    return (distances > radius).view(np.uint8)
+
+
+class FootprintCache(cache.LRUCache):
+    """
+    LRU cache of distance maps, optionally backed by a directory of .npy files.
+
+    The key is cache.map_key of the map, so the same map loaded again is a hit.
+    See cache.LRUCache for the counters, misses are distance transforms.
+    """
+    suffix = '.npy'
+
+    def __init__(self, max_entries: int = 8, cache_dir: str = None):
+        super().__init__(max_entries, cache_dir)
+
+    def _save(self, path, distances):
+        np.save(path, distances)
+
+    def _load(self, path):
+        return np.load(path, mmap_mode='r')
+
+    def distances(self, binary_map: np.ndarray) -> np.ndarray:
+        """distance_map of binary_map, from the cache if possible. Do not write to it."""
+        key = cache.map_key(binary_map, footprint='distance')
+        distances = self.get(key)
+        if distances is None:
+            self._miss()
+            distances = distance_map(binary_map)
+            distances.flags.writeable = False
+            self._insert(key, distances)
+            self._store(key, distances)
+        return distances
+
+    def erode(self, binary_map: np.ndarray, radius: float) -> np.ndarray:
+        """Free space of a robot with the given radius, see erode_map."""
+        return erode_map(self.distances(binary_map), radius)
+
+    def erode_all(self, binary_map: np.ndarray, radii) -> dict:
+        """{radius: eroded map} for every radius, with one distance transform."""
+        distances = self.distances(binary_map)
+        return {radius: erode_map(distances, radius) for radius in radii}
+
+    def decompose(self, binary_map: np.ndarray, radius: float, direction: str = 'vertical',
+                  decomposition_cache: cache.DecompositionCache = None) -> bcd.CellDecomposition:
+        """
+        Lazy decomposition of the free space of a robot with the given radius.
+
+        With a decomposition_cache, eroded maps which were decomposed before are
+        not decomposed again.
+        """
+        erode_img = self.erode(binary_map, radius)
+        if decomposition_cache is not None:
+            return decomposition_cache.decompose(erode_img, direction)
+        return bcd.bcd_sweep(erode_img, direction=direction, lazy=True)
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+
+    import map_io
+
+    path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(map_io.RESULTS_DIR, 'da.png')
+    binary_map = map_io.load_map(path)
+    radii = (1, 2, 3, 5, 8, 12)
+
+    start = time.perf_counter()
+    for radius in radii:
+        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * radius + 1, 2 * radius + 1))
+        cv2.erode(binary_map, kernel, borderType=cv2.BORDER_CONSTANT, borderValue=0)
+    erode_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    distances = distance_map(binary_map)
+    distance_time = time.perf_counter() - start
+    start = time.perf_counter()
+    eroded = {radius: erode_map(distances, radius) for radius in radii}
+    threshold_time = time.perf_counter() - start
+
+    print('{:>6} {:>8} {:>8}'.format('radius', 'free', 'cells'))
+    for radius, erode_img in eroded.items():
+        print('{:6d} {:8d} {:8d}'.format(radius, int(erode_img.sum()), len(bcd.bcd_sweep(erode_img, lazy=True))))
+    print('{} radii: cv2.erode {:.4f} s, distance transform {:.4f} s + thresholds {:.4f} s'.format(
+        len(radii), erode_time, distance_time, threshold_time))
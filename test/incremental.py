@@ -0,0 +1,113 @@
+"""
+Incremental re-decomposition for maps which change locally.
+
+When new obstacles show up only columns [col_start, col_end) change, so only
+these columns are swept again. Cell assignment goes on after col_end just until
+the old decomposition opens new cells again. From there on the old cells are
+still valid. Cells outside the swept range keep their numbers, new cells get
+numbers from bcd's current_cell on, so cell numbers can have gaps afterwards.
+The cell arrays are then rebuilt from the run table with array operations.
+"""
+import numpy as np
+
+import bcd
+
+
+def splice_runs(runs: bcd.RunTable, block: bcd.RunTable, col_start: int, col_end: int) -> bcd.RunTable:
+    """
+    Replaces the runs of columns [col_start, col_end) with the runs of block.
+    """
+    first, last = runs.offsets[col_start], runs.offsets[col_end]
+    shift = (first + block.offsets[-1]) - last
+    offsets = np.concatenate([runs.offsets[:col_start], first + block.offsets, runs.offsets[col_end + 1:] + shift])
+    starts = np.concatenate([runs.starts[:first], block.starts, runs.starts[last:]])
+    ends = np.concatenate([runs.ends[:first], block.ends, runs.ends[last:]])
+    return bcd.RunTable(offsets, starts, ends)
+
+
+def _cells_before(runs, labels, col):
+    """Connectivity of the last non-empty column and cells of the column before col."""
+    counts = runs.counts[:col]
+    nonempty = np.flatnonzero(counts)
+    last_connectivity = int(counts[nonempty[-1]]) if len(nonempty) else 0
+    if col == 0:
+        return last_connectivity, []
+    column_labels = labels[runs.offsets[col - 1]:runs.offsets[col]].tolist()
+    return last_connectivity, [cell for cell in column_labels if cell]
+
+
+def resweep(erode_img: np.ndarray, previous: bcd.CellDecomposition, col_start: int,
+            col_end: int) -> bcd.CellDecomposition:
+    """
+    Updates a decomposition after columns [col_start, col_end) of the map changed.
+
+    For a changed bounding box, use its left and right x as col_start and col_end
+    (top and bottom y if previous is a horizontal sweep).
+    previous is not modified, the result paints the changed columns on a copy of
+    previous.separate_img (so a read-only one, e.g. of map_io.load_decomposition,
+    works too). If previous.separate_img is not painted yet (see bcd.bcd_sweep's
+    lazy), the result is lazy as well and nothing is painted.
+
+    Args:
+        erode_img: [H, W], the updated eroded map.
+        previous: bcd.bcd_sweep (or resweep) result of the map before the change.
+        col_start: first changed column.
+        col_end: first column after the change.
+
+    Returns:
+        bcd.CellDecomposition of the updated map.
+    """
+    assert erode_img.shape == previous.map_shape, 'Map size should not change.'
+    sweep_img = bcd.sweep_view(erode_img, previous.direction)
+    width = sweep_img.shape[1]
+    old_runs, old_labels = previous.runs, previous.labels
+    block = bcd.column_runs(sweep_img[:, col_start:col_end])
+    runs = splice_runs(old_runs, block, col_start, col_end)
+
+    # After the changed columns the runs are the same as before, so old labels can stay
+    labels = np.concatenate([old_labels[:old_runs.offsets[col_start]],
+                             np.zeros(block.offsets[-1], dtype=old_labels.dtype),
+                             old_labels[old_runs.offsets[col_end]:]])
+    old_counts, counts = old_runs.counts.tolist(), runs.counts.tolist()
+    old_offsets, offsets = old_runs.offsets.tolist(), runs.offsets.tolist()
+    last_connectivity, current_cells = _cells_before(old_runs, old_labels, col_start)
+    old_last_connectivity = last_connectivity
+    current_cell = previous.current_cell
+
+    sync_col = width
+    for col in range(col_start, width):
+        connectivity, old_connectivity = counts[col], old_counts[col]
+        old_opens = bcd.opens_cells(old_last_connectivity, old_connectivity)
+        if col >= col_end and last_connectivity == old_last_connectivity and connectivity and old_opens:
+            # Both sweeps open the same new cells here, the old labels are valid from now on
+            sync_col = col
+            break
+        if old_connectivity or not old_last_connectivity:
+            old_last_connectivity = old_connectivity
+
+        labels[offsets[col]:offsets[col + 1]] = 0
+        if connectivity == 0 and last_connectivity != 0:
+            current_cells = []
+            continue
+        if bcd.opens_cells(last_connectivity, connectivity):
+            if old_opens and old_connectivity == connectivity and connectivity:
+                # Same cells open at the same column as before, keep their numbers
+                current_cells = old_labels[old_offsets[col]:old_offsets[col] + connectivity].tolist()
+            else:
+                current_cells = list(range(current_cell, current_cell + connectivity))
+                current_cell += connectivity
+        elif connectivity == 1:
+            current_cells = [current_cells[0]]
+
+        if current_cells:
+            labels[offsets[col]:offsets[col] + len(current_cells)] = current_cells
+        last_connectivity = connectivity
+
+    if previous.is_lazy:
+        return bcd.CellDecomposition.from_runs(runs, labels, current_cell, None, previous.direction, erode_img)
+    # New cell numbers can be larger than the dtype of the old separated map
+    separate_img = np.array(previous.separate_img, dtype=bcd.separate_dtype(previous.separate_img.dtype, current_cell))
+    sweep_separate_img = bcd.sweep_view(separate_img, previous.direction)
+    sweep_separate_img[:, col_start:sync_col] = sweep_img[:, col_start:sync_col]
+    bcd.paint_cells(runs, labels, sweep_separate_img[:, col_start:sync_col], col_start, sync_col)
+    return bcd.CellDecomposition.from_runs(runs, labels, current_cell, separate_img, previous.direction)
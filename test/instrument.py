@@ -0,0 +1,84 @@
+"""
+Opt-in instrumentation of the planning pipeline.
+
+Functions which support it take an instrument argument. By default it is
+NULL, which does nothing, so the overhead is one method call per stage:
+
+    instrument = Instrumentation()
+    decomposition = bcd.bcd_sweep(binary_map, instrument=instrument)
+    paths = move_boustrophedon.track_paths(original_map, order, decomposition,
+                                           decomposition.non_neighboor_cells,
+                                           display=False, instrument=instrument)
+    print(instrument.report())
+
+Stages are timed with instrument.stage(name) and counts are added with
+instrument.count(name, amount). Stages and counts are recorded once per
+call, never per column or per run.
+"""
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+
+
+class Instrumentation:
+    """
+    Records the wall time and calls of every stage, and counters.
+
+    Args:
+        on_stage: optional callback(name, seconds), called when a stage finishes
+        on_count: optional callback(name, amount), called for every count
+    """
+    def __init__(self, on_stage=None, on_count=None):
+        self.on_stage = on_stage
+        self.on_count = on_count
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.counts = defaultdict(int)
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            seconds = time.perf_counter() - start
+            self.seconds[name] += seconds
+            self.calls[name] += 1
+            if self.on_stage is not None:
+                self.on_stage(name, seconds)
+
+    def count(self, name: str, amount: int = 1):
+        self.counts[name] += amount
+        if self.on_count is not None:
+            self.on_count(name, amount)
+
+    def report(self) -> dict:
+        """{'stages': {name: {'seconds', 'calls'}}, 'counts': {name: amount}}, JSON serializable."""
+        return {'stages': {name: {'seconds': self.seconds[name], 'calls': self.calls[name]}
+                           for name in self.seconds},
+                'counts': dict(self.counts)}
+
+    def reset(self):
+        self.seconds.clear()
+        self.calls.clear()
+        self.counts.clear()
+
+
+class NullInstrumentation:
+    """Instrumentation which records nothing, the default."""
+    _null_stage = nullcontext()
+
+    def stage(self, name: str):
+        return self._null_stage
+
+    def count(self, name: str, amount: int = 1):
+        pass
+
+    def report(self) -> dict:
+        return {'stages': {}, 'counts': {}}
+
+    def reset(self):
+        pass
+
+
+NULL = NullInstrumentation()
@@ -4,14 +4,17 @@
 
 import bcd  #The Boustrophedon Cellular decomposition
 import dfs  #The Depth-first Search Algorithm
+import map_io  # Loads and thresholds the map
 import os
 import move_boustrophedon # Uses output of bcd cells in order to move the robot
+import sequencing  # Cell order with short transits between the cells
 
 import timeit
 
 
 if __name__ == '__main__':
-    os.chdir('/Users/haobo/UCL/FYP/bcd_py/results')
+    # Maps are in ../results, see plan_maps.py for planning maps without windows
+    os.chdir(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'results'))
     # Read the original data
     original_map = bcd.cv2.imread("da.png")
     #original_map = cv2.imread("../data/example2.png")[:,0:350]
@@ -24,25 +27,23 @@ if __name__ == '__main__':
     
     # We need binary image
     # 1's represents free space while 0's represents objects/walls
-    if len(original_map.shape) > 2:
-        print("Map image is converted to binary")
-        single_channel_map = original_map[:, :, 0]
-        _,binary_map = bcd.cv2.threshold(single_channel_map,127,1,bcd.cv2.THRESH_BINARY)
+    binary_map = map_io.load_map("da.png")
 
     # Call The Boustrophedon Cellular Decomposition function
-    bcd_out_im, bcd_out_cells, cell_numbers, cell_boundaries, non_neighboor_cell_numbers = bcd.bcd(binary_map)
+    decomposition = bcd.bcd_sweep(binary_map)
+    bcd_out_im, bcd_out_cells = decomposition.separate_img, decomposition.current_cell
+    cell_numbers = decomposition.keys()
+    # decomposition[cell] gives the (y_start, y_end) array of the cell, same as the cell_boundaries dict of bcd.bcd
+    cell_boundaries = decomposition
+    non_neighboor_cell_numbers = decomposition.non_neighboor_cells
+    graph4 = decomposition.graph()
     # Show the decomposed cells on top of original map
     bcd.display_separate_map(bcd_out_im, bcd_out_cells)
     move_boustrophedon.plt.show(block=False)
     #non_nei= [[2,3,4],[4,5,6]]
     #print(cell_boundaries)
     print(non_neighboor_cell_numbers)
-    def matrix_to_adj_list(matrix):
-        adj_list = {}
-        for i, row in enumerate(matrix): adj_list[i + 1] = [j + 1 for j, val in enumerate(row) if val == 1]
-        return adj_list
-
-    graph4 = matrix_to_adj_list(bcd.calculate_neighbour_matrix(cell_numbers, cell_boundaries, non_neighboor_cell_numbers))
+    # graph4 is a bcd.CellGraph, graph4[cell] gives the neighbour cells
 
 
     ######### DFS
@@ -51,9 +52,11 @@ if __name__ == '__main__':
     #starting_cell_number = move_boustrophedon.randint(1,len(cell_numbers))
     starting_cell_number = 1
     print("Starting cell number: ", starting_cell_number)
-    exec_time_dfs = timeit.timeit('dfs.dfs(cleaned_DFS, graph4, starting_cell_number)', \
-        'from __main__ import dfs, cleaned_DFS, graph4, starting_cell_number',number = iter_number)
+    # A new cleaned list for every run, with a shared one every run after the first returns at once
+    exec_time_dfs = timeit.timeit('dfs.dfs([], graph4, starting_cell_number)', \
+        'from __main__ import dfs, graph4, starting_cell_number',number = iter_number)
     exec_time_dfs = exec_time_dfs/iter_number
+    dfs.dfs(cleaned_DFS, graph4, starting_cell_number)
     print("DFS Cleaned cells in order", cleaned_DFS)
     print("Execution time of dfs in seconds: ", exec_time_dfs)
 
@@ -88,6 +91,12 @@ if __name__ == '__main__':
                     cell_numbers,cell_boundaries,non_neighboor_cell_numbers)
     y_coordinates = cell_boundaries
 
+    ######### Cell order by travel cost
+    cell_endpoints = sequencing.cell_endpoints(x_coordinates, y_coordinates)
+    print("DFS path length: ", sequencing.path_length(cell_endpoints, cleaned_DFS).total_length)
+    improved_order = sequencing.sequence_cells(cell_endpoints, starting_cell_number, mode='improve', time_budget=1.0)
+    print("Improved path length: ", improved_order.total_length)
+
     # mean_x_coordinates = {}
     # mean_y_coordinates = {}
     # for i in range(len(x_coordinates)):
@@ -104,11 +113,14 @@ if __name__ == '__main__':
     iter_number = 1
     dfs_path = cleaned_DFS
 
-    path_time_dfs = timeit.timeit('move_boustrophedon.track_paths(original_map,dfs_path,cell_boundaries,non_neighboor_cell_numbers)', \
+    path_time_dfs = timeit.timeit('move_boustrophedon.track_paths(original_map,dfs_path,cell_boundaries,non_neighboor_cell_numbers,display=False)', \
                                   'from __main__ import move_boustrophedon, \
                                   dfs_path, original_map, cell_boundaries,non_neighboor_cell_numbers',number = iter_number)
     path_time_dfs = path_time_dfs/iter_number
     print("Total path tracking time of dfs in seconds: ", path_time_dfs)
+    dfs_waypoints = move_boustrophedon.track_paths(original_map, dfs_path, cell_boundaries,
+                                                   non_neighboor_cell_numbers, display=False)
+    move_boustrophedon.display_paths(original_map, dfs_waypoints)
   
     move_boustrophedon.plt.waitforbuttonpress(1)
     input("Please press any key to close all figures.")
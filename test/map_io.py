@@ -0,0 +1,186 @@
+"""
+Loading and saving maps which are too large for memory.
+
+Maps are opened as memory-mapped arrays, bcd.column_runs and bcd.bcd_sweep
+read them one block of columns at a time, and the separated map can be
+written to a memory-mapped file as well:
+
+    binary_map = map_io.load_map('site.npy')
+    separate_img = map_io.open_label_map('site_cells.npy', binary_map.shape)
+    decomposition = bcd.bcd_sweep(binary_map, out=separate_img)
+
+Decompositions are saved as a directory of .npy files (save_decomposition),
+which load_decomposition memory-maps, so workers can share one saved
+decomposition without copying or parsing it.
+"""
+import glob
+import json
+import os
+
+import cv2
+import numpy as np
+
+import bcd
+
+
+# Sample maps of the repository
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'results')
+# Outputs of main.py and plan_maps.py, not maps
+OUTPUT_SUFFIXES = ('_bcd.png', '_track.png', '_pro.png', '_cells.png', '_coverage.png')
+
+
+def find_maps(sources):
+    """Map images of the given directories and glob patterns, without the output images."""
+    paths = []
+    for source in sources:
+        if os.path.isdir(source):
+            source = os.path.join(source, '*.png')
+        paths += [path for path in sorted(glob.glob(source)) if not path.endswith(OUTPUT_SUFFIXES)]
+    return paths
+
+
+class ThresholdedMap:
+    """
+    Binary map view of a grayscale map. Pixels above threshold are free space (1).
+
+    Only the requested part of the map is thresholded, so it works on memory-mapped maps.
+    It has the shape, dtype (uint8) and transposed view .T of the binary map, so it
+    can be given to bcd.bcd_sweep and cache.DecompositionCache like one.
+    """
+    def __init__(self, gray_map: np.ndarray, threshold: int = 127):
+        self.gray_map = gray_map
+        self.threshold = threshold
+
+    @property
+    def shape(self):
+        return self.gray_map.shape
+
+    @property
+    def dtype(self):
+        return np.dtype(np.uint8)
+
+    @property
+    def T(self) -> 'ThresholdedMap':
+        """Transposed view, for a horizontal sweep (see bcd.sweep_view)."""
+        return ThresholdedMap(self.gray_map.T, self.threshold)
+
+    def __getitem__(self, index) -> np.ndarray:
+        return (self.gray_map[index] > self.threshold).astype(np.uint8)
+
+
+def load_map(path: str, shape=None, dtype=np.uint8, threshold: int = None):
+    """
+    Opens a map.
+
+    Args:
+        path: .npy file, raw file (needs shape) or an image.
+            .npy and raw files are memory-mapped, images are read into memory.
+        shape: (H, W) of a raw file.
+        dtype: pixel type of a raw file.
+        threshold: if given, the map is grayscale and pixels above threshold are
+            free space, see ThresholdedMap. Images are always thresholded like
+            main.py does it (first channel, 127).
+
+    Returns:
+        [H, W] map which can be given to bcd.bcd_sweep.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.npy':
+        binary_map = np.load(path, mmap_mode='r')
+    elif shape is not None:
+        binary_map = np.memmap(path, dtype=dtype, mode='r', shape=tuple(shape))
+    else:
+        original_map = cv2.imread(path)
+        assert original_map is not None, 'Cannot read map {}'.format(path)
+        if len(original_map.shape) > 2:
+            original_map = original_map[:, :, 0]
+        _, binary_map = cv2.threshold(original_map, 127 if threshold is None else threshold, 1, cv2.THRESH_BINARY)
+        return binary_map
+    assert len(binary_map.shape) == 2, 'Map should be single channel.'
+    if threshold is not None:
+        return ThresholdedMap(binary_map, threshold)
+    return binary_map
+
+
+def open_label_map(path: str, shape, dtype=np.int32) -> np.ndarray:
+    """
+    Creates a memory-mapped .npy file for the separated map of bcd.bcd_sweep.
+    """
+    return np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=tuple(shape))
+
+
+# Version of the save_decomposition layout
+DECOMPOSITION_FORMAT = 1
+
+# Arrays of a saved decomposition, besides the optional separate_img
+_DECOMPOSITION_ARRAYS = ('run_offsets', 'run_starts', 'run_ends', 'labels', 'cells', 'x_start', 'x_end',
+                         'cell_offsets', 'y_bounds', 'graph_indptr', 'graph_indices', 'group_offsets',
+                         'group_cells')
+
+
+def save_decomposition(path: str, decomposition: bcd.CellDecomposition, separate_img: bool = False):
+    """
+    Saves a decomposition as a directory of .npy files and a meta.json.
+
+    Every array is saved as is: the run table, run labels, cell arrays,
+    the CSR adjacency graph and the non neighbour groups as offsets and cells.
+
+    Args:
+        path: directory, created if needed. Existing files are overwritten.
+        decomposition: bcd.CellDecomposition to save
+        separate_img: save the separated map too (paints a lazy one)
+    """
+    os.makedirs(path, exist_ok=True)
+    graph = decomposition.graph()
+    groups = decomposition.non_neighboor_cells
+    group_offsets = np.zeros(len(groups) + 1, dtype=np.int64)
+    np.cumsum([len(group) for group in groups], out=group_offsets[1:])
+    group_cells = np.array([cell for group in groups for cell in group], dtype=np.int32)
+    arrays = dict(zip(_DECOMPOSITION_ARRAYS, (
+        decomposition.runs.offsets, decomposition.runs.starts, decomposition.runs.ends, decomposition.labels,
+        decomposition.cells, decomposition.x_start, decomposition.x_end, decomposition.cell_offsets,
+        decomposition.y_bounds, graph.indptr, graph.indices, group_offsets, group_cells)))
+    if separate_img:
+        arrays['separate_img'] = decomposition.separate_img
+    for name, array in arrays.items():
+        np.save(os.path.join(path, name + '.npy'), np.ascontiguousarray(array))
+
+    meta = {'format': DECOMPOSITION_FORMAT, 'current_cell': int(decomposition.current_cell),
+            'direction': decomposition.direction, 'map_shape': list(decomposition.map_shape),
+            'separate_img': separate_img}
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+
+def load_decomposition(path: str, erode_img: np.ndarray = None, mmap_mode: str = 'r') -> bcd.CellDecomposition:
+    """
+    Loads a decomposition saved by save_decomposition.
+
+    Args:
+        path: directory of the decomposition
+        erode_img: map to paint separate_img from if it was not saved, see
+            bcd.CellDecomposition.lazy_copy
+        mmap_mode: see np.load, 'r' maps the arrays read-only without reading them,
+            None reads them into memory
+
+    Returns:
+        bcd.CellDecomposition whose arrays are memory-mapped.
+    """
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+    assert meta['format'] == DECOMPOSITION_FORMAT, 'Unknown decomposition format {}'.format(meta['format'])
+    assert erode_img is None or tuple(erode_img.shape) == tuple(meta['map_shape']), 'Map size does not match.'
+    arrays = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode)
+              for name in _DECOMPOSITION_ARRAYS}
+    separate_img = None
+    if meta['separate_img']:
+        separate_img = np.load(os.path.join(path, 'separate_img.npy'), mmap_mode=mmap_mode)
+
+    group_offsets = arrays['group_offsets'].tolist()
+    group_cells = arrays['group_cells'].tolist()
+    groups = [group_cells[begin:end] for begin, end in zip(group_offsets[:-1], group_offsets[1:])]
+    runs = bcd.RunTable(arrays['run_offsets'], arrays['run_starts'], arrays['run_ends'])
+    graph = bcd.CellGraph(arrays['graph_indptr'], arrays['graph_indices'])
+    return bcd.CellDecomposition(separate_img, meta['current_cell'], arrays['cells'], arrays['x_start'],
+                                 arrays['x_end'], arrays['cell_offsets'], arrays['y_bounds'], groups, runs,
+                                 arrays['labels'], meta['direction'], erode_img, graph, meta['map_shape'])
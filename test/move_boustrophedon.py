@@ -2,6 +2,8 @@ from matplotlib import pyplot as plt
 from random import randint
 import cv2
 import numpy as np
+
+from instrument import NULL as NULL_INSTRUMENT
 # def display_tracked_paths(input_im, x_coordinates,y_coordinates, cell_order):
 #     # Assumption: Robot will start moving from left most point of each cell
 #     # Cell order keeps the cell numbers in order, i.e. visit cell_order[0] first
@@ -277,43 +279,59 @@ import numpy as np
     
 #     return cells_x_coordinates
 
-def calculate_x_coordinates(x_size, y_size, cells_to_visit, cell_boundaries, nonneighbors):
+def calculate_x_coordinates(x_size, y_size, cells_to_visit, cell_boundaries, nonneighbors,
+                            instrument=NULL_INSTRUMENT):
     """
     Calculate x coordinates for each cell.
 
+    If cell_boundaries is a bcd.CellDecomposition, the columns recorded during
+    the sweep are used directly. Otherwise they are estimated from the cell
+    widths, cells separated by objects share the same x coordinates.
+
     Parameters:
         x_size (int): Total size of the x-axis.
         y_size (int): Total size of the y-axis.
         cells_to_visit (list): Order of cells to visit.
         cell_boundaries (dict): Contains y coordinates of each cell.
         nonneighbors (list): Cells separated by objects.
+        instrument: see instrument.py, records the stage x_coordinates.
 
     Returns:
-        dict: x coordinates of each cell.
+        dict: x coordinates of each cell, as a range.
     """
+    with instrument.stage('x_coordinates'):
+        return _x_coordinates(cells_to_visit, cell_boundaries, nonneighbors)
+
+
+def _x_coordinates(cells_to_visit, cell_boundaries, nonneighbors):
+    if hasattr(cell_boundaries, 'x_range'):
+        return {cell: cell_boundaries.x_range(cell) for cell in cell_boundaries}
+
     total_cell_number = len(cells_to_visit)
     cells_x_coordinates = {}
     width_accum_prev = 0
     cell_idx = 1
+    # First cell of each group of separated cells
+    groups = {}
+    for subneighbor in nonneighbors:
+        groups.setdefault(subneighbor[0], subneighbor)
 
     while cell_idx <= total_cell_number:
-        for subneighbor in nonneighbors:
-            if subneighbor[0] == cell_idx:
-                separated_cell_number = len(subneighbor)
-                if cell_idx in cell_boundaries:
-                    width_current_cell = len(cell_boundaries[cell_idx])
-                    for j in range(separated_cell_number):
-                        cells_x_coordinates[cell_idx + j] = list(range(width_accum_prev, width_current_cell + width_accum_prev))
-                    width_accum_prev += width_current_cell
-                    cell_idx += separated_cell_number
-                else:
-                    print(f"Warning: Cell index {cell_idx} not found in cell_boundaries.")
-                    cell_idx += separated_cell_number
-                break
+        if cell_idx in groups:
+            separated_cell_number = len(groups[cell_idx])
+            if cell_idx in cell_boundaries:
+                width_current_cell = len(cell_boundaries[cell_idx])
+                for j in range(separated_cell_number):
+                    cells_x_coordinates[cell_idx + j] = range(width_accum_prev, width_current_cell + width_accum_prev)
+                width_accum_prev += width_current_cell
+                cell_idx += separated_cell_number
+            else:
+                print(f"Warning: Cell index {cell_idx} not found in cell_boundaries.")
+                cell_idx += separated_cell_number
         else:
             if cell_idx in cell_boundaries:
                 width_current_cell = len(cell_boundaries[cell_idx])
-                cells_x_coordinates[cell_idx] = list(range(width_accum_prev, width_current_cell + width_accum_prev))
+                cells_x_coordinates[cell_idx] = range(width_accum_prev, width_current_cell + width_accum_prev)
                 width_accum_prev += width_current_cell
                 cell_idx += 1
             else:
@@ -324,7 +342,174 @@ def calculate_x_coordinates(x_size, y_size, cells_to_visit, cell_boundaries, non
 
 
 
-def track_paths(original_im, cells_to_visit, cell_boundaries, nonneighbors):
+def plan_paths(x_coordinates, y_coordinates, cell_order, robot_size=5, instrument=NULL_INSTRUMENT):
+    """
+    Boustrophedon waypoints of each cell, without any drawing.
+
+    Parameters:
+        x_coordinates (dict): x coordinates of each cell, see calculate_x_coordinates.
+        y_coordinates (dict): y coordinates of each cell, i.e. cell_boundaries of bcd
+            or a bcd.CellDecomposition.
+        cell_order (list): Order of cells to visit.
+        robot_size (int): Robot size in pixels, one waypoint covers a robot_size square.
+        instrument: see instrument.py, records the stage plan_paths and counts waypoints.
+
+    Returns:
+        dict: {cell: [N, 2] array of (x, y) waypoints}, in visiting order.
+            (x, y) is the top left corner of the covered square, in map coordinates
+            also for a 'horizontal' decomposition (see to_map_coordinates).
+    """
+    with instrument.stage('plan_paths'):
+        paths = _plan_paths(x_coordinates, y_coordinates, cell_order, robot_size)
+        paths = to_map_coordinates(paths, sweep_direction(y_coordinates))
+    instrument.count('waypoints', sum(len(waypoints) for waypoints in paths.values()))
+    return paths
+
+
+def sweep_direction(cell_boundaries):
+    """Sweep direction of a bcd.CellDecomposition, 'vertical' for the cell_boundaries dict of bcd."""
+    return getattr(cell_boundaries, 'direction', 'vertical')
+
+
+def to_map_coordinates(paths, direction='vertical'):
+    """
+    Waypoints in the sweep orientation to map coordinates.
+
+    A 'horizontal' decomposition sweeps the transposed map (see bcd.sweep_view),
+    so its x is the row and its y the column of the map.
+
+    Parameters:
+        paths (dict): {cell: [N, 2] waypoints} in the sweep orientation.
+        direction (str): 'vertical' or 'horizontal'.
+
+    Returns:
+        dict: {cell: [N, 2] (x, y) waypoints} in map coordinates.
+    """
+    if direction == 'vertical':
+        return paths
+    return {cell: waypoints[:, ::-1] for cell, waypoints in paths.items()}
+
+
+def _plan_paths(x_coordinates, y_coordinates, cell_order, robot_size):
+    paths = {}
+    for cell in cell_order:
+        x_start, x_end = x_coordinates[cell][0], x_coordinates[cell][-1]
+        x_end_modulated = x_end - (x_end % robot_size)
+        y_bounds = np.asarray(y_coordinates[cell]).reshape(-1, 2)
+
+        # One stripe per robot_size columns from the first column of the cell
+        j = np.arange(x_start, x_end_modulated + robot_size, robot_size)
+        y_start, y_end = y_bounds[(j - x_start) % len(y_bounds)].T
+        y_end_modulated = y_end - (y_end % robot_size)
+        # Stripes go down and up in turns, counted from the first stripe of the cell.
+        # The parity of j would make every stripe go up if the cell starts off a multiple of robot_size
+        move_down = np.arange(len(j)) % 2 == 0
+        first = np.where(move_down, y_start, y_end_modulated - robot_size)
+        step = np.where(move_down, robot_size, -robot_size)
+        count = np.maximum(-(-(y_end_modulated - y_start) // robot_size), 0)
+
+        stripe = np.repeat(np.arange(len(j)), count)
+        k = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count)
+        paths[cell] = np.stack([j[stripe], first[stripe] + step[stripe] * k], axis=1)
+    return paths
+
+
+def path_stripes(waypoints, image_shape, robot_size=5, direction='vertical'):
+    """
+    Rectangles covered by the waypoints of one cell, one per stripe.
+
+    Parameters:
+        waypoints (np.ndarray): [N, 2] (x, y) waypoints of a cell, see plan_paths.
+        image_shape (tuple): (H, W) of the map, rectangles are clipped to it.
+        robot_size (int): Robot size in pixels.
+        direction (str): sweep direction of the decomposition, stripes of a
+            'horizontal' one are rows.
+
+    Returns:
+        np.ndarray: [S, 4] rectangles as (y_start, y_end, x_start, x_end), ends excluded.
+    """
+    if direction == 'horizontal':
+        # Same stripes on the transposed map, then the rectangles are transposed back
+        return path_stripes(waypoints[:, ::-1], image_shape[::-1], robot_size)[:, [2, 3, 0, 1]]
+    x, y = waypoints[:, 0], waypoints[:, 1]
+    # Negative y would wrap around in slicing, such squares were never drawn
+    x, y = x[y >= 0], y[y >= 0]
+    if len(x) == 0:
+        return np.zeros([0, 4], dtype=np.int64)
+    # Waypoints of a stripe share their x and their squares touch each other
+    stripe_starts = np.flatnonzero(np.concatenate([[True], x[1:] != x[:-1]]))
+    y_start = np.minimum.reduceat(y, stripe_starts)
+    y_end = np.maximum.reduceat(y, stripe_starts) + robot_size
+    x_start = x[stripe_starts]
+    rectangles = np.stack([y_start, y_end, x_start, x_start + robot_size], axis=1)
+    rectangles[:, 0:2] = np.clip(rectangles[:, 0:2], 0, image_shape[0])
+    rectangles[:, 2:4] = np.clip(rectangles[:, 2:4], 0, image_shape[1])
+    return rectangles
+
+
+def _fill_rectangles(rectangles, shape):
+    # Corners of every rectangle go to a difference image, cumsum fills them
+    corners = np.zeros([shape[0] + 1, shape[1] + 1], dtype=np.int32)
+    y_start, y_end, x_start, x_end = rectangles.T
+    np.add.at(corners, (y_start, x_start), 1)
+    np.add.at(corners, (y_start, x_end), -1)
+    np.add.at(corners, (y_end, x_start), -1)
+    np.add.at(corners, (y_end, x_end), 1)
+    return corners.cumsum(axis=0).cumsum(axis=1)[:shape[0], :shape[1]] > 0
+
+
+def coverage_masks(paths, image_shape, robot_size=5, direction='vertical'):
+    """
+    Covered area of each cell.
+
+    Parameters:
+        paths (dict): {cell: waypoints}, see plan_paths.
+        image_shape (tuple): (H, W) of the map.
+        robot_size (int): Robot size in pixels.
+        direction (str): sweep direction, see path_stripes.
+
+    Returns:
+        dict: {cell: (top, left, mask)}, mask is a boolean array of the
+            bounding box of the covered area.
+    """
+    cell_masks = {}
+    for cell, waypoints in paths.items():
+        rectangles = path_stripes(waypoints, image_shape, robot_size, direction)
+        if len(rectangles) == 0:
+            cell_masks[cell] = (0, 0, np.zeros([0, 0], dtype=bool))
+            continue
+        top, left = rectangles[:, 0].min(), rectangles[:, 2].min()
+        bottom, right = rectangles[:, 1].max(), rectangles[:, 3].max()
+        local = rectangles - [top, top, left, left]
+        cell_masks[cell] = (int(top), int(left), _fill_rectangles(local, (bottom - top, right - left)))
+    return cell_masks
+
+
+def rasterize_coverage(input_im, paths, robot_size=5, path_color=(255, 0, 0), direction='vertical'):
+    """
+    Paints the covered area of all cells at once.
+
+    Parameters:
+        input_im (np.ndarray): Map image, it is not modified.
+        paths (dict): {cell: waypoints}, see plan_paths.
+        robot_size (int): Robot size in pixels.
+        path_color (tuple): Color of the covered area.
+        direction (str): sweep direction, see path_stripes.
+
+    Returns:
+        np.ndarray: Copy of input_im with the covered area painted.
+        dict: Covered area of each cell, see coverage_masks.
+    """
+    image_shape = input_im.shape[:2]
+    rectangles = [path_stripes(waypoints, image_shape, robot_size, direction) for waypoints in paths.values()]
+    coverage_im = np.copy(input_im)
+    if rectangles:
+        coverage_im[_fill_rectangles(np.concatenate(rectangles), image_shape)] = path_color
+    return coverage_im, coverage_masks(paths, image_shape, robot_size, direction)
+
+
+def track_paths(original_im, cells_to_visit, cell_boundaries, nonneighbors, display=True,
+                instrument=NULL_INSTRUMENT):
     """
         Input: original_im --> Input map image without any preprocessing
         Input: cells_to_visit --> It contains the order of cells to visit
@@ -334,18 +519,24 @@ def track_paths(original_im, cells_to_visit, cell_boundaries, nonneighbors):
             right
         Input: Nonneighbors --> This shows cels which are separated by the objects
                 ,so these cells should have the same x coordinates!
-        Output: draw the executed path on the image
+        Input: display --> draw the executed path on the image
             Path will be boustrophedonial --> zig,zag
-        Output: total travel time
+        Input: instrument --> see instrument.py, records x_coordinates, plan_paths and display
+        Output: waypoints of each cell, see plan_paths
     """
 
     total_cell_number = len(cells_to_visit)
     size_x = original_im.shape[1]
     size_y = original_im.shape[0]
 
-    cells_x_coordinates = calculate_x_coordinates(size_x, size_y, cells_to_visit, cell_boundaries, nonneighbors)
+    cells_x_coordinates = calculate_x_coordinates(size_x, size_y, cells_to_visit, cell_boundaries, nonneighbors,
+                                                  instrument)
+    paths = plan_paths(cells_x_coordinates, cell_boundaries, cells_to_visit, instrument=instrument)
     
-    display_tracked_paths(original_im, cells_x_coordinates, cell_boundaries, cells_to_visit)
+    if display:
+        with instrument.stage('display'):
+            display_paths(original_im, paths, direction=sweep_direction(cell_boundaries))
+    return paths
 
 def draw_cell_boundary(img, x, y_start, y_end, color=[255, 255, 255], thickness=1):
     """Draw a vertical line to represent cell boundary"""
@@ -355,6 +546,13 @@ def is_free_space(img, x, y):
     return np.all(img[y, x] != [0, 0, 0])  # 假设障碍物是黑色的
 
 def display_tracked_paths(input_im, x_coordinates, y_coordinates, cell_order):
+    display_paths(input_im, plan_paths(x_coordinates, y_coordinates, cell_order))
+
+def display_paths(input_im, paths, robot_size=5, direction='vertical'):
+    """
+    Draws the waypoints of plan_paths on input_im, one redraw per cell.
+    direction is the sweep direction of the decomposition, see path_stripes.
+    """
     fig_paths = plt.figure()
     plt.show(block=False)
     plt.ion()
@@ -362,37 +560,20 @@ def display_tracked_paths(input_im, x_coordinates, y_coordinates, cell_order):
     img_artist = ax.imshow(input_im)
     input("Press Enter to Start the Movement of the Robot")
 
-    robot_size = 5
     path_color = [255, 0, 0]  # Green color for the path
 
-    for i, cell in enumerate(cell_order):
+    cell_masks = coverage_masks(paths, input_im.shape[:2], robot_size, direction)
+    for i, (cell, waypoints) in enumerate(paths.items()):
         print("Current cell: ", cell)
-        x_start, x_end = x_coordinates[cell][0], x_coordinates[cell][-1]
-        x_end_modulated = x_end - (x_end % robot_size)
-
-        for j in range(x_start, x_end_modulated + robot_size, robot_size):
-            y_ind = (j - x_start) % len(y_coordinates[cell])
-            
-            if type(y_coordinates[cell][0]) is list:
-                y_start, y_end = y_coordinates[cell][y_ind][0][0], y_coordinates[cell][y_ind][0][1]
-            else:
-                y_start, y_end = y_coordinates[cell][y_ind][0], y_coordinates[cell][y_ind][1]
-            
-            y_end_modulated = y_end - (y_end % robot_size)
-
-            if (j % (2 * robot_size)) == 0:  # move down
-                for k in range(y_start, y_end_modulated, robot_size):
-                    input_im[k:k+robot_size, j:j+robot_size] = path_color
-            else:  # move up
-                for k in range(y_end_modulated - robot_size, y_start - robot_size, -robot_size):
-                    input_im[k:k+robot_size, j:j+robot_size] = path_color
+        top, left, mask = cell_masks[cell]
+        input_im[top:top + mask.shape[0], left:left + mask.shape[1]][mask] = path_color
 
-            img_artist.set_data(input_im)
-            plt.draw()
-            plt.pause(0.00000000001)
+        img_artist.set_data(input_im)
+        plt.draw()
+        plt.pause(0.00000000001)
 
         # # Draw cell boundary
-        # if i < len(cell_order) - 1:
+        # if i < len(paths) - 1:
         #     draw_cell_boundary(input_im, x_end, 0, input_im.shape[0])
         #     img_artist.set_data(input_im)
         #     plt.draw()
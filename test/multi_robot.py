@@ -0,0 +1,374 @@
+"""
+Multi-robot coverage.
+
+The cells of the decomposition are split into K groups, one per robot, so
+that every group is connected in the cell adjacency graph and the groups
+cover about the same area. Every robot then orders and plans its own group
+like a single robot does (see sequencing.py), the groups are planned in
+worker processes. The mission time of the fleet is the makespan, the
+longest path of a robot, since the robots clean at the same time.
+
+    plan = multi_robot.plan_fleet(binary_map, robots=4)
+    print(plan.makespan, [robot.cells for robot in plan.robots])
+
+Partitioning:
+    1. seeds --> first cell, then again and again the cell with the most
+       hops to the seeds so far (cells of other components first)
+    2. growth --> the group with the least area takes a neighbour cell, until
+       no group has a free neighbour. Components without a seed go to the
+       group with the least area as a whole.
+    3. balancing --> the group with the most area gives a border cell to a
+       smaller neighbour group, as long as the largest of the two gets
+       smaller and the group does not fall apart.
+A cell is never shared, so plan_fleet first splits cells which are larger
+than half of the area of a robot into pieces of neighbouring columns
+(split_cells).
+"""
+import heapq
+import os
+from collections import deque
+from typing import Dict, List, NamedTuple
+
+import numpy as np
+
+import bcd
+import move_boustrophedon
+import sequencing
+import worker_pool
+
+
+class RobotPlan(NamedTuple):
+    robot: int
+    cells: List[int]  # in visiting order
+    area: int  # free pixels of the cells
+    paths: Dict[int, np.ndarray]  # {cell: [N, 2] (x, y) waypoints}, see move_boustrophedon.plan_paths
+    coverage_length: float
+    transit_length: float
+    total_length: float
+
+
+class FleetPlan(NamedTuple):
+    robots: List[RobotPlan]
+    makespan: float  # longest total path of a robot
+    total_length: float  # sum of the paths of all robots
+    imbalance: float  # largest area of a robot / mean area
+
+
+def cell_areas(decomposition: bcd.CellDecomposition) -> np.ndarray:
+    """
+    Free pixels of every cell, from the cell boundaries. Indexed by cell number like the cell arrays.
+    """
+    heights = np.zeros(len(decomposition.y_bounds) + 1, dtype=np.int64)
+    np.cumsum(decomposition.y_bounds[:, 1] - decomposition.y_bounds[:, 0], out=heights[1:])
+    offsets = np.asarray(decomposition.cell_offsets)
+    return heights[offsets[1:]] - heights[offsets[:-1]]
+
+
+def split_cells(decomposition: bcd.CellDecomposition, max_area: int, robot_size=5,
+                erode_img: np.ndarray = None) -> bcd.CellDecomposition:
+    """
+    Splits cells with more than max_area pixels into narrower cells of neighbouring columns.
+
+    A single cell goes to a single robot, so without splitting the largest cell
+    limits the makespan. The runs of a large cell get new cell numbers every
+    few columns, the pieces are at least robot_size columns wide and start at
+    a multiple of robot_size from the left of the cell, so the stripes stay
+    at the same columns. Pieces are neighbours of each other in the new graph.
+    The pieces get new numbers, so the cells of a column are not numbered
+    consecutively anymore, bcd.non_neighbour_groups compares whole columns.
+
+    Args:
+        decomposition: bcd.CellDecomposition to split
+        max_area: cells larger than this are split into pieces of about max_area
+        robot_size: distance between two stripes in pixels
+        erode_img: map to paint separate_img from, see bcd.CellDecomposition.lazy_copy
+
+    Returns:
+        New bcd.CellDecomposition, cells which are not split keep their number.
+    """
+    areas = cell_areas(decomposition)
+    runs = decomposition.runs
+    labels = np.array(decomposition.labels)
+    run_cols = np.repeat(np.arange(len(runs.offsets) - 1), runs.counts)
+    current_cell = decomposition.current_cell
+    for cell in np.flatnonzero(areas > max(max_area, 0)).tolist():
+        bounds = decomposition[cell]
+        column_area = np.concatenate([[0], np.cumsum(bounds[:, 1] - bounds[:, 0])])
+        pieces = -(-int(areas[cell]) // max(int(max_area), 1))
+        # Piece k starts at the stripe where the area reaches k / pieces of the cell
+        stripes = np.arange(0, len(bounds), robot_size)
+        starts = np.unique(stripes[np.searchsorted(column_area[stripes], areas[cell] * np.arange(pieces) / pieces)
+                                   .clip(0, len(stripes) - 1)])
+        if len(starts) < 2:
+            continue
+        cell_runs = np.flatnonzero(labels == cell)
+        piece = np.searchsorted(starts, run_cols[cell_runs] - decomposition.x_start[cell], side='right') - 1
+        labels[cell_runs[piece > 0]] = current_cell + piece[piece > 0] - 1
+        current_cell += len(starts) - 1
+    return bcd.CellDecomposition.from_runs(runs, labels, current_cell, None, decomposition.direction, erode_img,
+                                           decomposition.map_shape)
+
+
+def _hops(graph, sources, cells):
+    # BFS hops from the nearest source, cells which cannot be reached are left out
+    hops = dict.fromkeys(sources, 0)
+    queue = deque(sources)
+    while queue:
+        cell = queue.popleft()
+        for neighbour in graph.neighbours(cell).tolist():
+            if neighbour in cells and neighbour not in hops:
+                hops[neighbour] = hops[cell] + 1
+                queue.append(neighbour)
+    return hops
+
+
+def _components(graph, cells):
+    # Connected components of the subgraph of cells, in order of their first cell
+    cells = set(cells)
+    component_of = {}
+    components = []
+    for cell in sorted(cells):
+        if cell in component_of:
+            continue
+        component = set(_hops(graph, [cell], cells))
+        component_of.update(dict.fromkeys(component, len(components)))
+        components.append(component)
+    return components
+
+
+def _splits(graph, cells, cell):
+    # True if removing cell from cells disconnects its neighbours in cells.
+    # One BFS per neighbour, taking turns. Searches which meet are merged, so it stops as soon as
+    # all have met, or when one runs out of cells: that side is cut off and it is the smallest one.
+    starts = [neighbour for neighbour in graph.neighbours(cell).tolist() if neighbour in cells]
+    if len(starts) <= 1:
+        return False
+    search_of = dict(zip(starts, range(len(starts))))
+    search_of[cell] = -1
+    parent = list(range(len(starts)))
+    queues = {search: deque([start]) for search, start in enumerate(starts)}
+
+    def root(search):
+        while parent[search] != search:
+            parent[search] = parent[parent[search]]
+            search = parent[search]
+        return search
+
+    while True:
+        for search in list(queues):
+            if search not in queues:
+                continue
+            queue = queues[search]
+            if not queue:
+                return True
+            for neighbour in graph.neighbours(queue.popleft()).tolist():
+                if neighbour not in cells:
+                    continue
+                other = search_of.get(neighbour)
+                if other is None:
+                    search_of[neighbour] = search
+                    queue.append(neighbour)
+                elif other != -1 and root(other) != search:
+                    other = root(other)
+                    parent[other] = search
+                    queue.extend(queues.pop(other))
+                    if len(queues) == 1:
+                        return False
+
+
+def _seeds(graph, cells, robots):
+    cell_set = set(cells)
+    seeds = [cells[0]]
+    while len(seeds) < robots:
+        hops = _hops(graph, seeds, cell_set)
+        # Cells which are not reached are in another component, they come first
+        seeds.append(max((cell for cell in cells if cell not in seeds),
+                         key=lambda cell: hops.get(cell, len(cells))))
+    return seeds
+
+
+def _grow(graph, cells, seeds, areas):
+    owner = dict.fromkeys(cells, -1)
+    group_areas = [0] * len(seeds)
+    frontiers = [[] for _ in seeds]
+
+    def take(group, cell):
+        owner[cell] = group
+        group_areas[group] += int(areas[cell])
+        for neighbour in graph.neighbours(cell).tolist():
+            if owner.get(neighbour) == -1:
+                heapq.heappush(frontiers[group], neighbour)
+
+    for group, seed in enumerate(seeds):
+        take(group, seed)
+    # Smallest group first, a group leaves the heap when it cannot grow anymore
+    heap = [(0, group) for group in range(len(seeds))]
+    while heap:
+        _, group = heapq.heappop(heap)
+        frontier = frontiers[group]
+        while frontier and owner[frontier[0]] != -1:
+            heapq.heappop(frontier)
+        if not frontier:
+            continue
+        take(group, heapq.heappop(frontier))
+        heapq.heappush(heap, (group_areas[group], group))
+
+    # Components without a seed, largest first
+    left = [cell for cell in cells if owner[cell] == -1]
+    for component in sorted(_components(graph, left), key=lambda component: -sum(areas[list(component)])):
+        group = int(np.argmin(group_areas))
+        for cell in component:
+            owner[cell] = group
+        group_areas[group] += int(sum(areas[list(component)]))
+    return owner
+
+
+def _balance(graph, owner, areas, robots, max_moves):
+    groups = [set() for _ in range(robots)]
+    for cell, group in owner.items():
+        groups[group].add(cell)
+    group_areas = [int(sum(areas[list(cells)])) for cells in groups]
+
+    def on_border(cell):
+        return any(owner.get(neighbour, owner[cell]) != owner[cell] for neighbour in graph.neighbours(cell).tolist())
+
+    # Cells with a neighbour in another group, kept up to date by the moves
+    borders = [{cell for cell in cells if on_border(cell)} for cells in groups]
+
+    for _ in range(max_moves):
+        largest = int(np.argmax(group_areas))
+        # Border cells of the largest group and a smaller neighbour group, smallest neighbour first
+        candidates = sorted({(group_areas[owner[neighbour]], cell, owner[neighbour])
+                             for cell in borders[largest] for neighbour in graph.neighbours(cell).tolist()
+                             if owner.get(neighbour, largest) != largest
+                             and group_areas[owner[neighbour]] + areas[cell] < group_areas[largest]})
+        for _, cell, other in candidates:
+            # The move must not split the largest group
+            if len(groups[largest]) > 1 and not _splits(graph, groups[largest], cell):
+                groups[largest].remove(cell)
+                groups[other].add(cell)
+                owner[cell] = other
+                group_areas[largest] -= int(areas[cell])
+                group_areas[other] += int(areas[cell])
+                for changed in [cell] + [neighbour for neighbour in graph.neighbours(cell).tolist()
+                                         if neighbour in owner]:
+                    borders[largest].discard(changed)
+                    borders[other].discard(changed)
+                    if on_border(changed):
+                        borders[owner[changed]].add(changed)
+                break
+        else:
+            break
+    return groups
+
+
+def partition_cells(decomposition: bcd.CellDecomposition, robots: int, max_moves: int = None) -> List[List[int]]:
+    """
+    Splits the cells into connected groups with about the same area, one group per robot.
+
+    Args:
+        decomposition: bcd.CellDecomposition, e.g. of bcd.bcd_sweep
+        robots: number of robots K
+        max_moves: most cells which balancing moves, number of cells by default
+
+    Returns:
+        K lists of cells, in cell order. The first cell of every group is its seed.
+        With more robots than cells, the extra robots get empty lists.
+    """
+    assert robots >= 1, 'At least one robot is needed.'
+    cells = decomposition.keys()
+    if robots >= len(cells):
+        return [[cell] for cell in cells] + [[] for _ in range(robots - len(cells))]
+    graph = decomposition.graph()
+    areas = cell_areas(decomposition)
+    seeds = _seeds(graph, cells, robots)
+    owner = _grow(graph, cells, seeds, areas)
+    groups = _balance(graph, owner, areas, robots, len(cells) if max_moves is None else max_moves)
+    # Seed first if it is still in the group, so the robot starts there
+    return [sorted(group, key=lambda cell: (cell != seed, cell)) for seed, group in zip(seeds, groups)]
+
+
+def _plan_group(group, robot_size, mode, time_budget):
+    decomposition = worker_pool.shared_data()
+    if not group:
+        return [], {}, 0.0, 0.0, 0.0
+    x_coordinates = {cell: decomposition.x_range(cell) for cell in group}
+    paths = move_boustrophedon.plan_paths(x_coordinates, decomposition, group, robot_size)
+    endpoints = sequencing.cell_endpoints(x_coordinates, decomposition, group, robot_size, paths)
+    sequence = sequencing.sequence_cells(endpoints, group[0], mode=mode, time_budget=time_budget)
+    paths = {cell: paths[cell] for cell in sequence.order}
+    return sequence.order, paths, sequence.coverage_length, sequence.transit_length, sequence.total_length
+
+
+def plan_groups(decomposition: bcd.CellDecomposition, groups: List[List[int]], robot_size=5, mode='greedy',
+                time_budget=1.0, max_workers=None) -> FleetPlan:
+    """
+    Orders and plans the cells of every robot, one robot per worker process.
+
+    Args:
+        decomposition: bcd.CellDecomposition of the map
+        groups: cells of every robot, see partition_cells. The first cell is where the robot starts.
+        robot_size: distance between two stripes in pixels
+        mode, time_budget: see sequencing.sequence_cells, time_budget is per robot
+        max_workers: process pool size, see worker_pool.run_tasks. 1 plans in this process.
+
+    Returns:
+        FleetPlan, waypoints are in map coordinates like plan_paths.
+    """
+    # Workers only need the cells, not the map nor separate_img
+    cells_only = decomposition.lazy_copy()
+    cells_only.graph()
+    results = worker_pool.run_tasks(_plan_group, [(group, robot_size, mode, time_budget) for group in groups],
+                                    cells_only, max_workers)
+
+    areas = cell_areas(decomposition)
+    robots = [RobotPlan(robot, order, int(areas[group].sum()) if group else 0, paths, coverage, transit, total)
+              for robot, (group, (order, paths, coverage, transit, total)) in enumerate(zip(groups, results))]
+    robot_areas = [robot.area for robot in robots]
+    mean_area = np.mean(robot_areas) if robots else 0
+    return FleetPlan(robots, max((robot.total_length for robot in robots), default=0.0),
+                     sum(robot.total_length for robot in robots),
+                     float(max(robot_areas) / mean_area) if mean_area else 1.0)
+
+
+def plan_fleet(binary_map: np.ndarray, robots: int, robot_size=5, mode='greedy', time_budget=1.0,
+               max_workers=None, decomposition: bcd.CellDecomposition = None, split: bool = True) -> FleetPlan:
+    """
+    Decomposes the map, splits the cells between the robots and plans every robot.
+
+    Args:
+        binary_map: [H, W], eroded map. The pixel value 0 represents obstacles and 1 for free space.
+        robots: number of robots K
+        robot_size, mode, time_budget, max_workers: see plan_groups
+        decomposition: decomposition of binary_map if it is known already, e.g. from cache.py
+        split: split cells larger than half of the area of a robot first, see split_cells.
+            The cells of the plan are then the pieces, not the cells of the decomposition.
+
+    Returns:
+        FleetPlan of the robots.
+    """
+    if decomposition is None:
+        decomposition = bcd.bcd_sweep(binary_map, lazy=True)
+    if split and robots > 1:
+        max_area = cell_areas(decomposition).sum() / (2 * robots)
+        decomposition = split_cells(decomposition, max_area, robot_size, binary_map)
+    groups = partition_cells(decomposition, robots)
+    return plan_groups(decomposition, groups, robot_size, mode, time_budget, max_workers)
+
+
+if __name__ == '__main__':
+    import sys
+
+    import map_io
+
+    path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(map_io.RESULTS_DIR, 'da.png')
+    binary_map = map_io.load_map(path)
+    decomposition = bcd.bcd_sweep(binary_map, lazy=True)
+    print('{:>6} {:>6} {:>10} {:>10} {:>9} {:>8}'.format('robots', 'split', 'makespan', 'total', 'imbalance',
+                                                         'speedup'))
+    single = plan_fleet(binary_map, 1, decomposition=decomposition).makespan
+    for robots in (1, 2, 3, 4, 6, 8):
+        for split in (False, True):
+            plan = plan_fleet(binary_map, robots, decomposition=decomposition, split=split)
+            print('{:6d} {:>6} {:10.1f} {:10.1f} {:9.2f} {:8.2f}'.format(
+                robots, str(split), plan.makespan, plan.total_length, plan.imbalance, single / plan.makespan))
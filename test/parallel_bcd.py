@@ -0,0 +1,109 @@
+"""
+Strip-wise parallel Boustrophedon Cellular Decomposition.
+
+The map is split into vertical strips. Each strip is decomposed on its own in
+a worker, as if it was a whole map. Then the strips are stitched from left to
+right: the first column with free space of a strip either opens new cells or
+keeps the cells of the last column of the strip before it (same rule as
+bcd.assign_cells), and all other cells of the strip are renumbered after the
+cells of the strips before it. The result is the same as bcd.bcd_sweep.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import List, Tuple
+
+import numpy as np
+
+import bcd
+
+
+def _decompose_strip(strip: np.ndarray) -> Tuple[bcd.RunTable, np.ndarray, int]:
+    runs = bcd.column_runs(strip)
+    labels, current_cell = bcd.assign_cells(runs)
+    return runs, labels, current_cell - 1
+
+
+def _stitch(strips: List[Tuple[bcd.RunTable, np.ndarray, int]]) -> Tuple[bcd.RunTable, np.ndarray, int]:
+    """
+    Joins the strip decompositions into the decomposition of the whole map.
+    """
+    last_connectivity = 0
+    current_cells = []
+    current_cell = 1
+    all_labels = []
+    for runs, labels, strip_cells in strips:
+        counts = runs.counts
+        nonempty = np.flatnonzero(counts)
+        lookup = np.zeros(strip_cells + 1, dtype=labels.dtype)
+        if len(nonempty) == 0:
+            # Fully blocked strip, same as fully blocked columns
+            if len(counts):
+                current_cells = []
+            all_labels.append(labels)
+            continue
+
+        first_col = int(nonempty[0])
+        connectivity = int(counts[first_col])
+        n_kept = 0
+        if not bcd.opens_cells(last_connectivity, connectivity):
+            # Cells of the first column continue the cells on the left of the seam.
+            # Local cells are numbered in opening order, so these are local cells 1..connectivity
+            kept_cells = current_cells if first_col == 0 else []
+            if connectivity == 1:
+                kept_cells = [kept_cells[0]]
+            lookup[1:1 + len(kept_cells)] = kept_cells
+            n_kept = connectivity
+        lookup[n_kept + 1:] = np.arange(current_cell, current_cell + strip_cells - n_kept)
+        current_cell += strip_cells - n_kept
+        labels = lookup[labels]
+        all_labels.append(labels)
+
+        last_connectivity = int(counts[nonempty[-1]])
+        last_labels = labels[runs.offsets[-2]:runs.offsets[-1]].tolist()
+        current_cells = [cell for cell in last_labels if cell]
+
+    offsets = [np.zeros(1, dtype=np.int64)]
+    for runs, _, _ in strips:
+        offsets.append(runs.offsets[1:] + offsets[-1][-1])
+    runs = bcd.RunTable(np.concatenate(offsets),
+                        np.concatenate([runs.starts for runs, _, _ in strips]),
+                        np.concatenate([runs.ends for runs, _, _ in strips]))
+    return runs, np.concatenate(all_labels), current_cell
+
+
+def bcd_parallel(erode_img: np.ndarray, n_strips: int = None, max_workers: int = None,
+                 use_processes: bool = False, direction: str = 'vertical', lazy: bool = False) -> bcd.CellDecomposition:
+    """
+    Same decomposition as bcd.bcd_sweep, with the strips decomposed in parallel.
+
+    Args:
+        erode_img: [H, W], eroded map. The pixel value 0 represents obstacles and 1 for free space.
+        n_strips: number of vertical strips, number of workers by default
+        max_workers: pool size, os.cpu_count() by default
+        use_processes: use a process pool instead of a thread pool. Threads are
+            enough since the strip decomposition is mostly NumPy, processes
+            need a copy of every strip.
+        direction: sweep direction, see bcd.bcd_sweep. Strips are across the sweep direction.
+        lazy: paint separate_img only when it is used, see bcd.bcd_sweep.
+
+    Returns:
+        bcd.CellDecomposition of the map.
+    """
+    assert len(erode_img.shape) == 2, 'Map should be single channel.'
+    sweep_img = bcd.sweep_view(erode_img, direction)
+    max_workers = max_workers or os.cpu_count() or 1
+    n_strips = max(1, min(n_strips or max_workers, sweep_img.shape[1]))
+    bounds = np.linspace(0, sweep_img.shape[1], n_strips + 1).astype(int)
+    strips = [sweep_img[:, begin:end] for begin, end in zip(bounds[:-1], bounds[1:])]
+
+    executor = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    with executor(max_workers=max_workers) as pool:
+        decomposed = list(pool.map(_decompose_strip, strips))
+
+    runs, labels, current_cell = _stitch(decomposed)
+    if lazy:
+        return bcd.CellDecomposition.from_runs(runs, labels, current_cell, None, direction, erode_img)
+    separate_img = np.asarray(erode_img[:, :])
+    separate_img = np.array(separate_img, dtype=bcd.separate_dtype(separate_img.dtype, current_cell))
+    bcd.paint_cells(runs, labels, bcd.sweep_view(separate_img, direction))
+    return bcd.CellDecomposition.from_runs(runs, labels, current_cell, separate_img, direction)
@@ -0,0 +1,211 @@
+"""
+Headless batch planning of many maps.
+
+Every map is planned in a worker process: threshold (like main.py) -->
+bcd --> adjacency graph --> cell order --> boustrophedon waypoints.
+No windows are opened, so it can run in a pipeline:
+
+    python plan_maps.py ../results --output plans --workers 4
+    python plan_maps.py "../results/test*.png" --order improve --draw
+    python plan_maps.py ../results --robot-radius 3 5 8 --footprint-cache footprints
+
+With --robot-radius, every map is planned for the free space of every robot
+radius (see footprint.py), the outputs are then named <name>_r<radius>.
+All radii of a map are planned by the same worker, so the map is loaded and
+its distance transform is computed only once.
+
+For every map <name>, the output directory gets:
+    <name>_cells.png --> separated map, pixel value is the cell number
+        (16 bit PNG, <name>_cells.npy if there are more than 65535 cells)
+    <name>_waypoints.csv --> cell, x, y of every waypoint in visiting order
+    <name>_coverage.png --> covered area drawn on the map, only with --draw
+and summary.json has the stats of every map and the total throughput.
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+import bcd
+import dfs
+import footprint
+import instrument
+import map_io
+import move_boustrophedon
+import sequencing
+
+
+def cell_order(decomposition, x_coordinates, order='dfs', robot_size=5, time_budget=1.0):
+    """
+    Order of the cells.
+
+    Args:
+        order: 'dfs' --> depth-first search over the adjacency graph from the first cell,
+                         cells the search does not reach are appended in cell order
+               'greedy', 'improve' --> see sequencing.sequence_cells
+    """
+    cells = decomposition.keys()
+    if not cells:
+        return []
+    if order == 'dfs':
+        visited = list(dfs.iter_dfs(decomposition.graph(), cells[0]))
+        seen = set(visited)
+        return visited + [cell for cell in cells if cell not in seen]
+    endpoints = sequencing.cell_endpoints(x_coordinates, decomposition, robot_size=robot_size)
+    return sequencing.sequence_cells(endpoints, cells[0], mode=order, time_budget=time_budget).order
+
+
+def write_waypoints(path, paths):
+    """Writes the waypoints as cell,x,y rows in visiting order."""
+    rows = [np.column_stack([np.full(len(waypoints), cell), waypoints]) for cell, waypoints in paths.items()]
+    rows = np.concatenate(rows) if rows else np.zeros([0, 3], dtype=np.int64)
+    np.savetxt(path, rows, fmt='%d', delimiter=',', header='cell,x,y', comments='')
+
+
+def _plan_radius(path, binary_map, output_dir, name, order, robot_size, time_budget, draw, stages):
+    # Plans the (eroded) map and writes its outputs, returns its stats
+    decomposition = bcd.bcd_sweep(binary_map, lazy=True, instrument=stages)
+    with stages.stage('adjacency'):
+        graph = decomposition.graph()
+    x_coordinates = move_boustrophedon.calculate_x_coordinates(
+        binary_map.shape[1], binary_map.shape[0], decomposition.keys(), decomposition,
+        decomposition.non_neighboor_cells, stages)
+    with stages.stage('order'):
+        cells = cell_order(decomposition, x_coordinates, order, robot_size, time_budget)
+    paths = move_boustrophedon.plan_paths(x_coordinates, decomposition, cells, robot_size, stages)
+    endpoints = sequencing.cell_endpoints(x_coordinates, decomposition, cells, robot_size, paths)
+    lengths = sequencing.path_length(endpoints, cells)
+
+    with stages.stage('write'):
+        separate_img = decomposition.separate_img
+        if decomposition.current_cell <= np.iinfo(np.uint16).max:
+            cv2.imwrite(os.path.join(output_dir, name + '_cells.png'), separate_img.astype(np.uint16))
+        else:
+            np.save(os.path.join(output_dir, name + '_cells.npy'), separate_img)
+        write_waypoints(os.path.join(output_dir, name + '_waypoints.csv'), paths)
+        if draw:
+            original_im = cv2.imread(path)
+            coverage_im, _ = move_boustrophedon.rasterize_coverage(original_im, paths, robot_size,
+                                                                   direction=decomposition.direction)
+            cv2.imwrite(os.path.join(output_dir, name + '_coverage.png'), coverage_im)
+
+    return {'status': 'ok', 'height': int(binary_map.shape[0]), 'width': int(binary_map.shape[1]),
+            'cells': len(decomposition), 'adjacency_edges': graph.edge_count,
+            'waypoints': int(sum(len(waypoints) for waypoints in paths.values())),
+            'order': cells, 'coverage_length': lengths.coverage_length,
+            'transit_length': lengths.transit_length, 'total_length': lengths.total_length,
+            'stages': stages.report()['stages'], 'counts': stages.report()['counts']}
+
+
+def plan_map(path, output_dir, order='dfs', robot_size=5, time_budget=1.0, draw=False, radii=(0,),
+             footprint_dir=None):
+    """
+    Plans one map for every robot radius and writes its outputs.
+
+    Args:
+        radii: robot radii in pixels, the map is eroded by every radius first
+            (see footprint.py). 0 plans the thresholded map as it is.
+        footprint_dir: directory where the distance maps are cached, so a later
+            batch with other radii does not compute them again
+
+    Returns:
+        Stats of every radius, JSON serializable. Errors are reported in the stats
+        instead of raised, so one bad map does not stop the batch. The load and
+        footprint stages are shared by the radii and are in the stats of every radius.
+    """
+    base_name = os.path.splitext(os.path.basename(path))[0]
+    results = [{'map': path, 'name': base_name + ('_r{:g}'.format(radius) if radius else ''), 'radius': radius}
+               for radius in radii]
+    start = time.perf_counter()
+    map_stages = instrument.Instrumentation()
+    try:
+        with map_stages.stage('load'):
+            binary_map = map_io.load_map(path)
+        eroded = {0: binary_map}
+        if any(radii):
+            with map_stages.stage('footprint'):
+                footprints = footprint.FootprintCache(max_entries=1, cache_dir=footprint_dir)
+                eroded.update(footprints.erode_all(binary_map, [radius for radius in radii if radius]))
+    except Exception as error:
+        seconds = time.perf_counter() - start
+        for stats in results:
+            stats.update({'status': 'error', 'error': repr(error), 'seconds': seconds})
+        return results
+    map_seconds = time.perf_counter() - start
+
+    for stats in results:
+        start = time.perf_counter()
+        stages = instrument.Instrumentation()
+        try:
+            stats.update(_plan_radius(path, eroded[stats['radius']], output_dir, stats['name'], order,
+                                      robot_size, time_budget, draw, stages))
+            stats['stages'] = {**map_stages.report()['stages'], **stats['stages']}
+        except Exception as error:
+            stats.update({'status': 'error', 'error': repr(error)})
+        stats['seconds'] = map_seconds + time.perf_counter() - start
+    return results
+
+
+def plan_maps(paths, output_dir, workers=None, order='dfs', robot_size=5, time_budget=1.0, draw=False,
+              radii=(0,), footprint_dir=None):
+    """
+    Plans every map for every robot radius in a process pool and writes output_dir/summary.json.
+
+    Returns:
+        Summary with the stats of every map and radius, in the order of paths, and the totals.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(plan_map, path, output_dir, order, robot_size, time_budget, draw, radii,
+                               footprint_dir)
+                   for path in paths]
+        results = [stats for future in futures for stats in future.result()]
+    seconds = time.perf_counter() - start
+
+    planned = [stats for stats in results if stats['status'] == 'ok']
+    pixels = sum(stats['height'] * stats['width'] for stats in planned)
+    summary = {'maps': len(results), 'planned': len(planned), 'failed': len(results) - len(planned),
+               'workers': workers, 'seconds': seconds,
+               'maps_per_s': len(planned) / seconds if seconds else None,
+               'pixels_per_s': pixels / seconds if seconds else None,
+               'cells': sum(stats['cells'] for stats in planned),
+               'waypoints': sum(stats['waypoints'] for stats in planned),
+               'results': results}
+    with open(os.path.join(output_dir, 'summary.json'), 'w') as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Plans boustrophedon coverage paths for a batch of maps.')
+    parser.add_argument('maps', nargs='+', help='directories of .png maps or glob patterns')
+    parser.add_argument('--output', default='plans', help='output directory')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes, os.cpu_count() by default')
+    parser.add_argument('--order', choices=['dfs', 'greedy', 'improve'], default='dfs', help='cell order')
+    parser.add_argument('--robot-size', type=int, default=5, help='robot size in pixels')
+    parser.add_argument('--time-budget', type=float, default=1.0, help='seconds per map for --order improve')
+    parser.add_argument('--draw', action='store_true', help='also write the covered area drawn on the map')
+    parser.add_argument('--robot-radius', type=float, nargs='+', default=[0],
+                        help='robot radii in pixels to plan every map for, 0 does not erode the map')
+    parser.add_argument('--footprint-cache', default=None, help='directory to cache the distance maps in')
+    args = parser.parse_args()
+
+    map_paths = map_io.find_maps(args.maps)
+    summary = plan_maps(map_paths, args.output, args.workers, args.order, args.robot_size, args.time_budget,
+                        args.draw, args.robot_radius, args.footprint_cache)
+    for stats in summary['results']:
+        if stats['status'] == 'ok':
+            print("{:<40}{:>7} cells{:>9} waypoints{:>10.3f} s".format(
+                stats['name'], stats['cells'], stats['waypoints'], stats['seconds']))
+        else:
+            print("{:<40} failed: {}".format(stats['name'], stats['error']))
+    print("{} of {} maps planned in {:.2f} s with {} workers, {:.1f} maps/s, {:.3g} pixels/s".format(
+        summary['planned'], summary['maps'], summary['seconds'], summary['workers'],
+        summary['maps_per_s'] or 0, summary['pixels_per_s'] or 0))
+    print('Summary written to', os.path.join(args.output, 'summary.json'))
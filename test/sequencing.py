@@ -0,0 +1,189 @@
+"""
+Travel cost aware ordering of the cells.
+
+Coverage of a cell is the boustrophedon path of move_boustrophedon.plan_paths,
+so every cell has a fixed entry point (its first waypoint) and exit point
+(its last waypoint), and the coverage length is the length of the polyline
+through its waypoints. Transit between cells is the straight line distance
+from the exit of a cell to the entry of the next.
+"""
+import time
+from typing import List, NamedTuple
+
+import numpy as np
+
+import move_boustrophedon
+
+
+class CellEndpoints(NamedTuple):
+    cells: List[int]
+    entries: np.ndarray  # [N, 2], (x, y) where the coverage of a cell starts
+    exits: np.ndarray  # [N, 2], (x, y) where the coverage of a cell finishes
+    coverage: np.ndarray  # [N], path length inside every cell
+    stripes: np.ndarray  # [N], number of stripes of every cell
+
+
+class CellSequence(NamedTuple):
+    order: List[int]
+    coverage_length: float
+    transit_length: float
+    total_length: float
+
+
+def cell_endpoints(x_coordinates, cell_boundaries, cells=None, robot_size=5, paths=None) -> CellEndpoints:
+    """
+    Calculates entry/exit points and coverage path length of every cell.
+
+    Args:
+        x_coordinates: {cell: x coordinates}, see move_boustrophedon.calculate_x_coordinates
+        cell_boundaries: {cell: [(y_start, y_end), ...]}, one entry per column, see bcd.bcd
+        cells: cells to use, all cells of x_coordinates by default
+        robot_size: distance between two stripes in pixels
+        paths: waypoints of the cells if they are planned already, see move_boustrophedon.plan_paths
+
+    Returns:
+        CellEndpoints of the cells, in map coordinates like plan_paths. A cell too
+        small for a waypoint starts and finishes at its top left corner.
+    """
+    if cells is None:
+        cells = list(x_coordinates)
+    if paths is None:
+        paths = move_boustrophedon.plan_paths(x_coordinates, cell_boundaries, cells, robot_size)
+    entries = np.zeros([len(cells), 2])
+    exits = np.zeros([len(cells), 2])
+    coverage = np.zeros(len(cells))
+    stripes = np.zeros(len(cells), dtype=np.int64)
+    direction = move_boustrophedon.sweep_direction(cell_boundaries)
+    for i, cell in enumerate(cells):
+        waypoints = paths[cell]
+        if not len(waypoints):
+            corner = x_coordinates[cell][0], np.asarray(cell_boundaries[cell]).reshape(-1, 2)[0, 0]
+            entries[i] = exits[i] = corner if direction == 'vertical' else corner[::-1]
+            continue
+        steps = np.diff(waypoints, axis=0)
+        entries[i] = waypoints[0]
+        exits[i] = waypoints[-1]
+        coverage[i] = np.hypot(*steps.T).sum()
+        # A stripe is a run of waypoints with the same x, the same y for a horizontal sweep
+        stripes[i] = np.count_nonzero(steps[:, 0 if direction == 'vertical' else 1]) + 1
+    return CellEndpoints(list(cells), entries, exits, coverage, stripes)
+
+
+def _transits(endpoints, tour):
+    # Transit lengths from tour[k] to tour[k + 1]
+    return np.hypot(*(endpoints.entries[tour[1:]] - endpoints.exits[tour[:-1]]).T)
+
+
+def _to_sequence(endpoints, tour) -> CellSequence:
+    coverage_length = float(endpoints.coverage[tour].sum())
+    transit_length = float(_transits(endpoints, tour).sum())
+    return CellSequence([endpoints.cells[k] for k in tour], coverage_length,
+                        transit_length, coverage_length + transit_length)
+
+
+def path_length(endpoints: CellEndpoints, order) -> CellSequence:
+    """
+    Coverage, transit and total path length of the given cell order, e.g. a DFS order.
+    """
+    index = {cell: k for k, cell in enumerate(endpoints.cells)}
+    return _to_sequence(endpoints, np.array([index[cell] for cell in order], dtype=np.int64))
+
+
+def _greedy_tour(endpoints, start):
+    # Always go to the closest cell which is not cleaned yet
+    visited = np.zeros(len(endpoints.cells), dtype=bool)
+    tour = [start]
+    visited[start] = True
+    for _ in range(len(endpoints.cells) - 1):
+        distances = np.hypot(*(endpoints.entries - endpoints.exits[tour[-1]]).T)
+        distances[visited] = np.inf
+        tour.append(int(np.argmin(distances)))
+        visited[tour[-1]] = True
+    return np.array(tour, dtype=np.int64)
+
+
+def _two_opt_pass(endpoints, tour, deadline):
+    """Reverses tour segments while it helps. Tour[0] stays in place. Returns True if improved."""
+    entries, exits = endpoints.entries, endpoints.exits
+    n = len(tour)
+    improved = False
+    for i in range(1, n - 1):
+        if time.perf_counter() > deadline:
+            break
+        forward = _transits(endpoints, tour)
+        backward = np.hypot(*(entries[tour[:-1]] - exits[tour[1:]]).T)
+        forward_sum = np.concatenate([[0], np.cumsum(forward)])
+        backward_sum = np.concatenate([[0], np.cumsum(backward)])
+        # Reverse tour[i:j + 1] for all j > i at once
+        j = np.arange(i + 1, n)
+        delta = np.hypot(*(entries[tour[j]] - exits[tour[i - 1]]).T) - forward[i - 1] \
+            + (backward_sum[j] - backward_sum[i]) - (forward_sum[j] - forward_sum[i])
+        has_next = j < n - 1
+        delta[has_next] += np.hypot(*(entries[tour[j[has_next] + 1]] - exits[tour[i]]).T) \
+            - forward[j[has_next]]
+        best = int(np.argmin(delta))
+        if delta[best] < -1e-9:
+            tour[i:j[best] + 1] = tour[i:j[best] + 1][::-1].copy()
+            improved = True
+    return improved
+
+
+def _or_opt_pass(endpoints, tour, deadline, max_segment=3):
+    """Moves segments of up to max_segment cells to a better place. Returns True if improved."""
+    entries, exits = endpoints.entries, endpoints.exits
+    improved = False
+    for length in range(1, max_segment + 1):
+        i = 1
+        while i + length <= len(tour):
+            if time.perf_counter() > deadline:
+                return improved
+            segment = tour[i:i + length]
+            rest = np.concatenate([tour[:i], tour[i + length:]])
+            forward = _transits(endpoints, tour)
+            # Gain of taking the segment out
+            delta_remove = -forward[i - 1]
+            if i + length < len(tour):
+                delta_remove += np.hypot(*(entries[tour[i + length]] - exits[tour[i - 1]])) \
+                    - forward[i + length - 1]
+            # Cost of putting it back after rest[p], for every p
+            rest_forward = _transits(endpoints, rest)
+            delta_insert = np.hypot(*(entries[segment[0]] - exits[rest]).T)
+            delta_insert[:-1] += np.hypot(*(entries[rest[1:]] - exits[segment[-1]]).T) - rest_forward
+            delta_insert[i - 1] = np.inf  # Same place as before
+            p = int(np.argmin(delta_insert))
+            if delta_remove + delta_insert[p] < -1e-9:
+                tour[:] = np.concatenate([rest[:p + 1], segment, rest[p + 1:]])
+                improved = True
+            i += 1
+    return improved
+
+
+def sequence_cells(endpoints: CellEndpoints, start_cell=None, mode='greedy', time_budget=1.0) -> CellSequence:
+    """
+    Finds a cell order with short transits between the cells.
+
+    Args:
+        endpoints: see cell_endpoints
+        start_cell: first cell to clean, first cell of endpoints by default
+        mode: 'greedy' --> nearest cell first
+              'improve' --> greedy order improved by 2-opt and Or-opt moves
+        time_budget: seconds which 'improve' can spend on the improvement moves
+
+    Returns:
+        CellSequence with the order and the coverage, transit and total path length.
+    """
+    assert mode in ('greedy', 'improve'), 'Unknown mode {}'.format(mode)
+    if not endpoints.cells:
+        return CellSequence([], 0.0, 0.0, 0.0)
+    start = 0 if start_cell is None else endpoints.cells.index(start_cell)
+    tour = _greedy_tour(endpoints, start)
+
+    if mode == 'improve':
+        deadline = time.perf_counter() + time_budget
+        while time.perf_counter() < deadline:
+            improved = _two_opt_pass(endpoints, tour, deadline)
+            improved = _or_opt_pass(endpoints, tour, deadline) or improved
+            if not improved:
+                break
+
+    return _to_sequence(endpoints, tour)
@@ -0,0 +1,153 @@
+"""
+Sweep angle search.
+
+bcd sweeps along the image columns, so the coverage stripes are always
+vertical. For another sweep angle the map is rotated by that angle first
+(nearest neighbour, everything outside of the map is obstacle), then it is
+decomposed and the cells are sequenced as usual. Every angle is evaluated
+in a worker process and the cheapest plan is kept.
+
+Turns are counted on the stripes of move_boustrophedon.plan_paths: two
+turns between two stripes of a cell and two turns for the transit to the
+next cell, i.e. 2 * (number of stripes - 1).
+"""
+import os
+import time
+from typing import Dict, List, NamedTuple, Tuple
+
+import cv2
+import numpy as np
+
+import bcd
+import move_boustrophedon
+import sequencing
+import worker_pool
+
+
+class AngleStats(NamedTuple):
+    angle: float
+    cells: int
+    turns: int
+    coverage_length: float
+    transit_length: float
+    total_length: float
+    decompose_time: float  # seconds for rotation and decomposition
+    sequence_time: float  # seconds for the cell order
+
+
+class AnglePlan(NamedTuple):
+    angle: float
+    matrix: np.ndarray  # [2, 3], affine transform from the map to the rotated map
+    decomposition: bcd.CellDecomposition  # of the rotated map
+    order: List[int]
+    paths: Dict[int, np.ndarray]  # {cell: [N, 2] (x, y) waypoints}, in map coordinates
+    stats: AngleStats
+
+
+def rotate_map(binary_map: np.ndarray, angle: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Rotates the map counter clockwise by angle degrees, the image grows so the whole map fits.
+
+    Returns:
+        rotated map and the [2, 3] affine transform from map to rotated map coordinates.
+    """
+    height, width = binary_map.shape
+    # Rotation around the center of the middle pixel, so 90 degrees is exactly np.rot90
+    matrix = cv2.getRotationMatrix2D(((width - 1) / 2, (height - 1) / 2), angle, 1.0)
+    cos, sin = abs(matrix[0, 0]), abs(matrix[0, 1])
+    # Small epsilon so 0 and 90 degrees do not get an extra row or column
+    rotated_width = int(np.ceil(height * sin + width * cos - 1e-6))
+    rotated_height = int(np.ceil(height * cos + width * sin - 1e-6))
+    matrix[0, 2] += (rotated_width - width) / 2
+    matrix[1, 2] += (rotated_height - height) / 2
+    rotated = cv2.warpAffine(np.ascontiguousarray(binary_map, dtype=np.uint8), matrix,
+                             (rotated_width, rotated_height), flags=cv2.INTER_NEAREST,
+                             borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+    return rotated, matrix
+
+
+def to_map_coordinates(points: np.ndarray, matrix: np.ndarray) -> np.ndarray:
+    """
+    Transforms [N, 2] (x, y) points of the rotated map back to the map.
+    """
+    inverse = cv2.invertAffineTransform(matrix)
+    return np.asarray(points, dtype=np.float64) @ inverse[:, :2].T + inverse[:, 2]
+
+
+def _decompose(binary_map, angle):
+    rotated, matrix = rotate_map(binary_map, angle)
+    # Only boundaries are needed, separate_img is painted if the caller uses it
+    decomposition = bcd.bcd_sweep(rotated, lazy=True)
+    x_coordinates = move_boustrophedon.calculate_x_coordinates(
+        rotated.shape[1], rotated.shape[0], decomposition.keys(), decomposition,
+        decomposition.non_neighboor_cells)
+    return matrix, decomposition, x_coordinates
+
+
+def _evaluate_angle(angle, robot_size, mode, time_budget) -> Tuple[AngleStats, List[int]]:
+    start = time.perf_counter()
+    _, decomposition, x_coordinates = _decompose(worker_pool.shared_data(), angle)
+    decompose_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    endpoints = sequencing.cell_endpoints(x_coordinates, decomposition, robot_size=robot_size)
+    sequence = sequencing.sequence_cells(endpoints, mode=mode, time_budget=time_budget)
+    sequence_time = time.perf_counter() - start
+
+    stripes = int(endpoints.stripes.sum())
+    stats = AngleStats(angle, len(endpoints.cells), max(2 * (stripes - 1), 0), sequence.coverage_length,
+                       sequence.transit_length, sequence.total_length, decompose_time, sequence_time)
+    return stats, sequence.order
+
+
+def search_angles(binary_map: np.ndarray, angles=range(0, 180, 15), robot_size=5, objective='length',
+                  mode='greedy', time_budget=1.0, max_workers=None) -> Tuple[AnglePlan, List[AngleStats]]:
+    """
+    Plans the coverage at every sweep angle and keeps the cheapest plan.
+
+    Args:
+        binary_map: [H, W], eroded map. The pixel value 0 represents obstacles and 1 for free space.
+        angles: sweep angles in degrees, [0, 180) is enough since 180 gives the same stripes as 0
+        robot_size: distance between two stripes in pixels
+        objective: 'length' --> shortest total path
+                   'turns' --> fewest turns, ties are broken by the total path
+        mode, time_budget: see sequencing.sequence_cells, time_budget is per angle
+        max_workers: process pool size, see worker_pool.run_tasks
+
+    Returns:
+        AnglePlan of the best angle and AngleStats of every angle, in the order of angles.
+    """
+    assert objective in ('length', 'turns'), 'Unknown objective {}'.format(objective)
+    assert len(binary_map.shape) == 2, 'Map should be single channel.'
+    angles = list(angles)
+    results = worker_pool.run_tasks(_evaluate_angle, [(angle, robot_size, mode, time_budget) for angle in angles],
+                                    binary_map, max_workers)
+
+    all_stats = [stats for stats, _ in results]
+    if objective == 'length':
+        best = min(range(len(results)), key=lambda k: all_stats[k].total_length)
+    else:
+        best = min(range(len(results)), key=lambda k: (all_stats[k].turns, all_stats[k].total_length))
+    stats, order = results[best]
+
+    # Only the order comes back from the worker, the decomposition is cheap to redo here
+    matrix, decomposition, x_coordinates = _decompose(binary_map, stats.angle)
+    paths = move_boustrophedon.plan_paths(x_coordinates, decomposition, order, robot_size)
+    paths = {cell: to_map_coordinates(waypoints, matrix) for cell, waypoints in paths.items()}
+    return AnglePlan(stats.angle, matrix, decomposition, order, paths, stats), all_stats
+
+
+if __name__ == '__main__':
+    import sys
+
+    import map_io
+
+    path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(map_io.RESULTS_DIR, 'da.png')
+    plan, all_stats = search_angles(map_io.load_map(path))
+    print('{:>6} {:>6} {:>6} {:>10} {:>10} {:>8} {:>8}'.format(
+        'angle', 'cells', 'turns', 'transit', 'total', 'bcd s', 'order s'))
+    for stats in all_stats:
+        print('{:6.1f} {:6d} {:6d} {:10.1f} {:10.1f} {:8.3f} {:8.3f}'.format(
+            stats.angle, stats.cells, stats.turns, stats.transit_length, stats.total_length,
+            stats.decompose_time, stats.sequence_time))
+    print('Best angle: ', plan.angle)
@@ -0,0 +1,56 @@
+"""
+Process pools with data shared by all tasks.
+
+Large read-only data (a map, the cells of a decomposition) is sent to every
+worker process once by the pool initializer, instead of being pickled with
+every task. Tasks read it with shared_data():
+
+    def _evaluate(angle):
+        binary_map = worker_pool.shared_data()
+        ...
+
+    results = worker_pool.run_tasks(_evaluate, [(angle,) for angle in angles], binary_map)
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+# Data of the pool of this worker process, set by _set_shared_data
+_shared_data = None
+
+
+def _set_shared_data(data):
+    global _shared_data
+    _shared_data = data
+
+
+def shared_data():
+    """Data given to run_tasks, in a task."""
+    return _shared_data
+
+
+def run_tasks(function, tasks, data, max_workers=None) -> list:
+    """
+    Runs function(*task) for every task in a process pool whose workers get data once.
+
+    Args:
+        function: module level function, so it can be pickled
+        tasks: argument tuples, one per task
+        data: read with shared_data() by the tasks
+        max_workers: pool size, os.cpu_count() by default and never more than the tasks.
+            1 runs the tasks in this process without a pool.
+
+    Returns:
+        Results in the order of tasks.
+    """
+    tasks = list(tasks)
+    max_workers = min(max_workers or os.cpu_count() or 1, max(len(tasks), 1))
+    if max_workers == 1:
+        previous = _shared_data
+        _set_shared_data(data)
+        try:
+            return [function(*task) for task in tasks]
+        finally:
+            _set_shared_data(previous)
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_set_shared_data, initargs=(data,)) as pool:
+        futures = [pool.submit(function, *task) for task in tasks]
+        return [future.result() for future in futures]